@@ -112,6 +112,8 @@ class GETACTION(object):
             parse_index += 1
             self.legalActions.append(itemized[parse_index])
 
+        self.timeBank = float(itemized[parse_index+1]) # number of seconds left for our bot to return an action
+
     def getBoard(self):
         """
         Returns the board as Card objects
@@ -7,7 +7,8 @@ import time
 from random import random, choice
 from pokereval.card import Card
 from query_cfr import chooseAction, chooseActionRandom, getStrategy
-from cfr import getHandStrength, determineBestDiscardFast, convertHtoI, LightweightHistory, convertSyntax
+from cfr import getHandStrength, determineBestDiscardAnytime, determineBestDiscardTurn, getDiscardPolicy, cardsToIndices, convertHtoI, LightweightHistory, convertSyntax, EQUITY_CACHE
+import cfr
 import json
 from ParsePackets import *
 
@@ -22,6 +23,14 @@ FORCED_ACTION = None
 # CREATE THE GLOBAL HISTORY #
 HISTORY = LightweightHistory([], 1, 0, 0, 0, 0, 0, 0, 0, 200, 200, [], [], [])
 
+# a discard decision may spend this share of the time that each hand left in the match gets,
+# and this many seconds of the timebank are kept back to cover the overruns that getDiscardDeadline allows
+DISCARD_TIME_SHARE = 0.25
+TIMEBANK_RESERVE = 0.5
+# seconds that a discard decision costs however little time it has: building the turn's TurnContext (~20ms),
+# the exact turn decision (~10ms) or the first sampling round (~2ms). Taken off the deadline up front
+DISCARD_FIXED_COST = 0.05
+
 
 def mapBetToAbstractionAbsolute(betAmt):
     """
@@ -147,7 +156,36 @@ def resetHistory():
     HISTORY.P1_Hand, HISTORY.P2_Hand, HISTORY.Board, HISTORY.History = [], [], [], []
 
 
-def handleDiscard(hand, board):
+def getDiscardDeadline(received_time):
+    """
+    Gets the time.time() by which a discard decision has to be made. The timebank left (minus TIMEBANK_RESERVE) is
+    split evenly between the hands left in the match, and a discard decision gets DISCARD_TIME_SHARE of a hand's share,
+    minus DISCARD_FIXED_COST. Past the deadline, a decision can still spend up to DISCARD_FIXED_COST and one sampling
+    round, which come out of TIMEBANK_RESERVE when the share is too small to cover them.
+    received_time: when the GETACTION packet arrived, since its timebank was measured then
+    """
+    global NEWGAME_PACKET, NEWHAND_PACKET, GETACTION_PACKET
+    handsLeft = max(NEWGAME_PACKET.numHands - NEWHAND_PACKET.handID + 1, 1)
+    return received_time + DISCARD_TIME_SHARE * max(GETACTION_PACKET.timeBank - TIMEBANK_RESERVE, 0.0) / handsLeft - DISCARD_FIXED_COST
+
+
+def decideDiscard(hand, board, deadline):
+    """
+    Decides whether to discard, and which card: a lookup if the discard policy tables have the board, the exact
+    decision on the turn if the deadline (a time.time()) hasn't passed yet, and otherwise determineBestDiscardAnytime()
+    refining its estimate until the deadline.
+    Returns: (shouldDiscard, discardIndex, swapEV, originalEV)
+    """
+    decision = getDiscardPolicy(cardsToIndices(hand), cardsToIndices(board))
+    if decision == None and len(board) == 4 and time.time() < deadline:
+        decision = determineBestDiscardTurn(hand, board)
+    elif decision == None:
+        decision = determineBestDiscardAnytime(hand, board, deadline)
+        print "Discard decision used %d samples" % decision[4]
+    return decision[0:4]
+
+
+def handleDiscard(hand, board, deadline):
     """
     Decides whether to discard, and which card.
     Returns either "CHECK" or "DISCARD:*card*", which is the action to be sent.
@@ -156,7 +194,7 @@ def handleDiscard(hand, board):
     global GETACTION_PACKET
     assert ("DISCARD:%s" % hand[0]) in GETACTION_PACKET.legalActions
 
-    shouldSwap, swapIndex, swapEV, originalEV = determineBestDiscardFast(hand, board)
+    shouldSwap, swapIndex, swapEV, originalEV = decideDiscard(hand, board, deadline)
 
     if shouldSwap:
         return "DISCARD:%s\n" % hand[swapIndex]
@@ -422,6 +460,7 @@ class Player:
             #print "FORCED ACTION:", FORCED_ACTION
             # Block until the engine sends us a packet.
             data = f_in.readline().strip()
+            receivedTime = time.time() # the timebank in the packet was measured around now
             # If data is None, connection has closed.
             if not data:
                 print "Gameover, engine disconnected."
@@ -461,7 +500,8 @@ class Player:
 
                     # if a discard section
                     if inDiscardSection:
-                        shouldDiscard, discardIndex, swapEV, originalHandEV = determineBestDiscardFast(HISTORY.P1_Hand, HISTORY.Board)
+                        # refine the decision for as long as our share of the timebank allows
+                        shouldDiscard, discardIndex, swapEV, originalHandEV = decideDiscard(HISTORY.P1_Hand, HISTORY.Board, getDiscardDeadline(receivedTime))
 
                         if shouldDiscard:
                             discardAction = 'DISCARD:%s\n' % convertSyntax(HISTORY.P1_Hand[discardIndex])
@@ -555,6 +595,10 @@ class Player:
                 # Send FINISH to indicate you're done.
                 s.send("FINISH\n")
 
+                # save the hand strengths we computed so the next match starts warm
+                EQUITY_CACHE.printStats()
+                EQUITY_CACHE.save()
+
         # Clean up the socket.
         s.close()
 
@@ -564,8 +608,14 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='A Pokerbot.', add_help=False, prog='pokerbot')
     parser.add_argument('-h', dest='host', type=str, default='localhost', help='Host to connect to, defaults to localhost')
     parser.add_argument('port', metavar='PORT', type=int, help='Port on host to connect to')
+    parser.add_argument('--equity-backend', dest='equity_backend', type=str, default=None, choices=cfr.EQUITY_BACKENDS.keys(),
+                        help='Equity backend to use, defaults to pbots_calc if it is installed and numpy otherwise')
     args = parser.parse_args()
 
+    if args.equity_backend != None:
+        cfr.setEquityBackend(args.equity_backend)
+    print 'Using the %s equity backend' % cfr.EQUITY_BACKEND
+
     # Create a socket connection to the engine.
     print 'Connecting to %s:%d' % (args.host, args.port)
     try:
@@ -574,5 +624,8 @@ if __name__ == '__main__':
         print 'Error connecting! Aborting'
         exit()
 
+    # warm start the hand strength cache from previous matches
+    EQUITY_CACHE.load()
+
     bot = Player()
     bot.run(s)
@@ -0,0 +1,279 @@
+#!/usr/bin/env
+
+"""
+Per-board rank indexes for exact river and turn equity.
+
+A BoardContext ranks all 1081 holdings on a 5 card board once. After that, the exact equity of any holding
+against a random opponent holding is a couple of binary searches: count the holdings that rank below it on the
+whole board, then subtract the ones that share one of its cards (which the opponent can't hold).
+
+A TurnContext holds a BoardContext for every possible river card on a 4 card board.
+
+Cards are ints 0-51 (see isomorphism.py).
+"""
+
+import numpy as np
+from itertools import combinations
+from handeval import evaluate
+
+# DEFINE THINGS #
+# positions (in the 47 cards left after the board) of the 2 cards of each of the 1081 holdings
+HOLDING_PAIRS = np.array(list(combinations(range(47), 2)), dtype=np.int64)
+
+# HOLDINGS_WITH_POSITION[p] = indices of the 46 holdings that use the card at position p
+HOLDINGS_WITH_POSITION = np.array([np.nonzero((HOLDING_PAIRS == p).any(axis=1))[0] for p in range(47)], dtype=np.int64)
+
+# spacing between rows when several sorted rank lists are searched as one flat array (ranks are < 8192)
+RANK_ROW_OFFSET = 8192
+# END DEFINITIONS #
+
+
+class BoardContext(object):
+    """
+    Sorted ranks of every holding on a 5 card board, with the bookkeeping needed to remove blocked holdings.
+    board: a list of 5 card ints
+    """
+    def __init__(self, board):
+        assert len(board) == 5, "Error: a BoardContext needs a 5 card board"
+        self.Board = list(board)
+        self.Remaining = np.setdiff1d(np.arange(52), self.Board) # the 47 cards not on the board
+        self.Holdings = self.Remaining[HOLDING_PAIRS] # (1081, 2)
+
+        boardCards = np.tile(np.array(self.Board, dtype=np.int64), (len(self.Holdings), 1))
+        self.Ranks = evaluate(np.concatenate([self.Holdings, boardCards], axis=1)).astype(np.int64)
+        self.SortedRanks = np.sort(self.Ranks)
+
+        # HoldingIndex[c1][c2] = index of holding (c1, c2), or -1 if a card is on the board
+        self.HoldingIndex = np.empty((52, 52), dtype=np.int64)
+        self.HoldingIndex.fill(-1)
+        self.HoldingIndex[self.Holdings[:, 0], self.Holdings[:, 1]] = np.arange(len(self.Holdings))
+        self.HoldingIndex[self.Holdings[:, 1], self.Holdings[:, 0]] = np.arange(len(self.Holdings))
+
+        # CardPosition[c] = position of card c in self.Remaining, or -1 if it's on the board
+        self.CardPosition = np.empty(52, dtype=np.int64)
+        self.CardPosition.fill(-1)
+        self.CardPosition[self.Remaining] = np.arange(len(self.Remaining))
+
+        # sorted ranks of the holdings that use each remaining card, flattened with RANK_ROW_OFFSET between rows
+        rowOffsets = np.arange(len(self.Remaining))[:, None] * RANK_ROW_OFFSET
+        self.SortedCardRanks = (np.sort(self.Ranks[HOLDINGS_WITH_POSITION], axis=1) + rowOffsets).ravel()
+
+    def getRanks(self, hands):
+        """
+        Gets the hand rank (see handeval.py) of each hand on this board.
+        hands: an int array of shape (H, 2)
+        """
+        hands = np.asarray(hands, dtype=np.int64)
+        indices = self.HoldingIndex[hands[:, 0], hands[:, 1]]
+        assert (indices >= 0).all(), "Error: a hand uses a card that is on the board"
+        return self.Ranks[indices]
+
+    def getWinsAndTies(self, hands, dead=None):
+        """
+        Counts the opponent holdings that each hand beats and ties, out of the ones that don't share a card with it
+        (990 holdings, or 946 if a dead card is given too).
+        hands: an int array of shape (H, 2)
+        dead: None, or an int array of shape (H,) with one extra card per hand that the opponent can't hold (i.e a discard)
+        Returns: (wins, ties), int arrays of shape (H,)
+        """
+        hands = np.asarray(hands, dtype=np.int64)
+        ranks = self.getRanks(hands)
+        blockers = [hands[:, 0], hands[:, 1]] if dead is None else [hands[:, 0], hands[:, 1], np.asarray(dead, dtype=np.int64)]
+
+        wins = np.searchsorted(self.SortedRanks, ranks, 'left')
+        ties = np.searchsorted(self.SortedRanks, ranks, 'right') - wins
+        for cards in blockers:
+            positions = self.CardPosition[cards]
+            queries = ranks + positions * RANK_ROW_OFFSET
+            rowStarts = positions * HOLDINGS_WITH_POSITION.shape[1]
+            lessCard = np.searchsorted(self.SortedCardRanks, queries, 'left') - rowStarts
+            wins = wins - lessCard
+            ties = ties - (np.searchsorted(self.SortedCardRanks, queries, 'right') - rowStarts - lessCard)
+
+        # add back the holdings made of 2 blockers, since they were removed twice
+        for i in range(len(blockers)):
+            for j in range(i+1, len(blockers)):
+                blockerRanks = self.Ranks[self.HoldingIndex[blockers[i], blockers[j]]]
+                wins = wins + (blockerRanks < ranks)
+                ties = ties + (blockerRanks == ranks)
+        return (wins, ties)
+
+    def getEquities(self, hands=None, dead=None):
+        """
+        Gets the exact equity (wins + 0.5*ties, over every opponent holding that isn't blocked) of each hand
+        against a random opponent holding.
+        hands: an int array of shape (H, 2), or None for every holding in self.Holdings
+        dead: None, or an int array of shape (H,) with a dead card for each hand (see getWinsAndTies)
+        Returns: a float array of shape (H,)
+        """
+        wins, ties = self.getWinsAndTies(self.Holdings if hands is None else hands, dead)
+        return (wins + 0.5*ties) / (990.0 if dead is None else 946.0)
+
+    def getEquity(self, hand, dead=None):
+        """
+        Gets the exact equity of a single hand (a list of 2 card ints), optionally with one dead card.
+        """
+        return float(self.getEquities([hand], None if dead == None else [dead])[0])
+
+    def getDeadCardEquities(self):
+        """
+        Gets the exact equity of every holding in self.Holdings with each remaining card dead, all at once.
+        Returns: a float array of shape (1081, 47), where [h][p] is the equity of self.Holdings[h] when self.Remaining[p]
+            is dead (see getWinsAndTies), and NaN where self.Remaining[p] is one of the holding's cards
+        """
+        wins, ties = self.getWinsAndTies(self.Holdings)
+        positions = np.arange(len(self.Remaining))
+        queries = self.Ranks[:, None] + positions[None, :] * RANK_ROW_OFFSET
+        rowStarts = positions * HOLDINGS_WITH_POSITION.shape[1]
+        lessCard = np.searchsorted(self.SortedCardRanks, queries, 'left') - rowStarts
+        equalCard = np.searchsorted(self.SortedCardRanks, queries, 'right') - rowStarts - lessCard
+
+        # the holdings made of the dead card and one of our cards were already removed with our cards
+        for k in range(2):
+            blockerRanks = self.Ranks[self.HoldingIndex[self.Holdings[:, k:k+1], self.Remaining[None, :]]]
+            lessCard = lessCard - (blockerRanks < self.Ranks[:, None])
+            equalCard = equalCard - (blockerRanks == self.Ranks[:, None])
+
+        equities = ((wins[:, None] - lessCard) + 0.5*(ties[:, None] - equalCard)) / 946.0
+        equities[np.arange(len(self.Holdings)), HOLDING_PAIRS[:, 0]] = np.nan
+        equities[np.arange(len(self.Holdings)), HOLDING_PAIRS[:, 1]] = np.nan
+        return equities
+
+
+class TurnContext(object):
+    """
+    A BoardContext for every possible river card on a 4 card board, so that exact turn equities (averaged over
+    every river card and opponent holding) and EHS^2 are just lookups.
+    board: a list of 4 card ints
+    """
+    def __init__(self, board):
+        assert len(board) == 4, "Error: a TurnContext needs a 4 card board"
+        self.Board = list(board)
+        self.Rivers = np.setdiff1d(np.arange(52), self.Board) # the 48 possible river cards
+        self.Contexts = [BoardContext(self.Board + [r]) for r in self.Rivers]
+
+    def getRiverEquities(self, hands, dead=None):
+        """
+        Gets the exact equity of each hand on each possible river card.
+        hands: an int array of shape (H, 2)
+        dead: None, or an int array of shape (H,) with a dead card for each hand
+        Returns: a float array of shape (H, 48), with NaN where the river card is one of the hand's cards (or its dead card)
+        """
+        hands = np.asarray(hands, dtype=np.int64)
+        dead = None if dead is None else np.asarray(dead, dtype=np.int64)
+        equities = np.empty((len(hands), len(self.Rivers)))
+        equities.fill(np.nan)
+
+        for i in range(len(self.Rivers)):
+            valid = (hands[:, 0] != self.Rivers[i]) & (hands[:, 1] != self.Rivers[i])
+            if dead is not None:
+                valid &= (dead != self.Rivers[i])
+            if valid.any():
+                equities[valid, i] = self.Contexts[i].getEquities(hands[valid], None if dead is None else dead[valid])
+        return equities
+
+    def getEquities(self, hands, dead=None):
+        """
+        Gets the exact turn equity of each hand: every river card (and then every opponent holding) is equally likely,
+        so this is just the mean over river cards.
+        """
+        return np.nanmean(self.getRiverEquities(hands, dead), axis=1)
+
+    def getEHS2(self, hands, dead=None):
+        """
+        Gets the exact expected hand strength squared (the mean of the squared river equity) of each hand.
+        """
+        return np.nanmean(self.getRiverEquities(hands, dead) ** 2, axis=1)
+
+    def getEquity(self, hand, dead=None):
+        """
+        Gets the exact turn equity of a single hand (a list of 2 card ints), optionally with one dead card.
+        """
+        return float(self.getEquities([hand], None if dead == None else [dead])[0])
+
+    def getSwapEquities(self, hand):
+        """
+        Gets the exact turn equity of every hand we could end up with after discarding either card of hand.
+        The discarded card is dead: it can't come back as the replacement, the river or an opponent card.
+        hand: a list of 2 card ints
+        Returns: (replacements, equities) where replacements is an int array of the 46 possible new cards, and
+            equities[i][j] is the equity after discarding hand[i] and drawing replacements[j]
+        """
+        # both discards in one batch, so every river's BoardContext is searched once
+        replacements = np.setdiff1d(self.Rivers, hand)
+        numReplacements = len(replacements)
+        newHands = np.stack([np.tile(replacements, 2), np.repeat([hand[1], hand[0]], numReplacements)], axis=1)
+        equities = self.getEquities(newHands, np.repeat(hand, numReplacements))
+        return (replacements, equities.reshape(2, numReplacements))
+
+
+def getHandStrengthMoments(board, hands):
+    """
+    Gets the exact expected hand strength (EHS) and expected hand strength squared (EHS^2) of many hands on a flop or
+    turn board, where the hand strength is the river equity against a random opponent holding. Every runout is
+    enumerated, and all the holdings on each final board are ranked at once with a BoardContext.
+    E[HS^2] - EHS^2 is the variance of the river hand strength, so it measures a hand's potential.
+    board: a list of 3 or 4 card ints
+    hands: an int array of shape (H, 2)
+    Returns: (ehs, ehs2), float arrays of shape (H,)
+    """
+    assert len(board) == 3 or len(board) == 4, "Error: hand strength moments need a flop or turn board"
+    board = list(board)
+    if len(board) == 4:
+        contexts = TurnContext(board).Contexts
+    else:
+        deck = np.setdiff1d(np.arange(52), board)
+        contexts = (BoardContext(board + list(runout)) for runout in combinations(deck, 2))
+
+    # accumulate over every final board, indexed by the holding's (low card, high card)
+    sums = np.zeros((52, 52))
+    sumSquares = np.zeros((52, 52))
+    counts = np.zeros((52, 52))
+    for context in contexts:
+        equities = context.getEquities()
+        low, high = context.Holdings[:, 0], context.Holdings[:, 1]
+        sums[low, high] += equities
+        sumSquares[low, high] += equities ** 2
+        counts[low, high] += 1
+
+    hands = np.asarray(hands, dtype=np.int64)
+    low, high = hands.min(axis=1), hands.max(axis=1)
+    assert (counts[low, high] > 0).all(), "Error: a hand uses a card that is on the board"
+    return (sums[low, high] / counts[low, high], sumSquares[low, high] / counts[low, high])
+
+
+def getFlopSwapEquities(board, hand, num_runouts=None, seed=None):
+    """
+    Gets the equity of a hand on a flop board, and of every hand we could end up with after discarding either of its
+    cards. Every hand is scored on the same runouts (num_runouts of them sampled without replacement, or all 1081 if
+    None) against every opponent holding, so the differences between hands have very little noise. The discarded
+    card is dead, and a runout that uses a hand's replacement card doesn't count for that hand.
+    board: a list of 3 card ints
+    hand: a list of 2 card ints
+    Returns: (replacements, equities, originalEquity) where replacements and equities are like in
+        TurnContext.getSwapEquities (47 replacements here), and originalEquity is the equity of hand itself
+    """
+    assert len(board) == 3, "Error: flop swap equities need a 3 card board"
+    board, hand = list(board), list(hand)
+    replacements = np.setdiff1d(np.arange(52), board + hand)
+    runouts = replacements[HOLDING_PAIRS] # every (turn, river) pair of the cards left in the deck
+    if num_runouts != None and num_runouts < len(runouts):
+        runouts = runouts[np.random.RandomState(seed).choice(len(runouts), num_runouts, replace=False)]
+
+    # discarding hand[0] for each replacement, then discarding hand[1] for each replacement
+    numReplacements = len(replacements)
+    newHands = np.concatenate([np.stack([replacements, np.repeat(hand[1], numReplacements)], axis=1),
+                               np.stack([np.repeat(hand[0], numReplacements), replacements], axis=1)])
+    dead = np.repeat(hand, numReplacements)
+    newCards = np.tile(replacements, 2)
+
+    sums = np.zeros(len(newHands))
+    counts = np.zeros(len(newHands))
+    originalSum = 0.0
+    for runout in runouts:
+        context = BoardContext(board + list(runout))
+        valid = (newCards != runout[0]) & (newCards != runout[1])
+        sums[valid] += context.getEquities(newHands[valid], dead[valid])
+        counts[valid] += 1
+        originalSum += context.getEquities([hand])[0]
+    return (replacements, (sums / counts).reshape(2, numReplacements), originalSum / len(runouts))
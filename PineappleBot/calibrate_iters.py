@@ -0,0 +1,133 @@
+#!/usr/bin/env
+
+"""
+Calibrates the iteration counts of sampled flop and turn equities (EQUITY_ITERS in cfr.py).
+
+Random (hand, board) states are dealt for each street, and the exact answers are worked out for each one:
+    bucket:  the hand's NUM_BUCKETS bucket, from its exact strength (flop and turn)
+    discard: what determineBestDiscardFast should decide, from the exact EVs of keeping the hand and of swapping
+             either card with the discarded card dead (see board_context.getFlopSwapEquities). Flop only, since
+             determineBestDiscardFast is exact on the turn.
+Then for each candidate iteration count, the bucket that getHandStrengthBuckets resolves with that many max_iters
+(from a cold cache, so it's the sampler the bot actually runs, early stopping included), and the decision of
+determineBestDiscardFast with that many iterations per swap (and 10x that for the original hand, the ratio cfr.py
+has always used), are compared with the exact answers. The states are spread over a process pool.
+
+For each street and setting, the smallest iteration count whose error rate is within --max-error of the lowest
+error rate measured is written to equity_config.json, which cfr.py loads at startup. (determineBestDiscardFast
+picks the card to keep with a heuristic, so its error rate never goes to 0.) The measured rates are saved too.
+
+Usage: python calibrate_iters.py [--states 200] [--max-error 0.02] [--processes N]
+"""
+
+import argparse
+import cfr
+from cfr import *
+from multiprocessing import Pool
+
+CANDIDATE_ITERS = [50, 100, 200, 400, 800, 1600]
+STREETS = {3: "flop", 4: "turn"}
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "equity_config.json")
+
+
+def dealState(board_size):
+    """
+    Deals a random hand and board with board_size cards, as lists of Card objects.
+    """
+    dealer = Dealer()
+    hand = dealer.dealHand()
+    board = dealer.dealFlop() + [dealer.dealCard() for i in range(board_size - 3)]
+    return (hand, board)
+
+
+def getExactAnswers(hand, board, min_improvement=0.02):
+    """
+    Gets the exact strength bucket and, on the flop, the exact discard decision (shouldDiscard, discardIndex) of a
+    state (None on the turn).
+    """
+    handCards, boardCards = cardsToIndices(hand), cardsToIndices(board)
+    if len(board) == 4:
+        return (getBucket(TurnContext(boardCards).getEquity(handCards), NUM_BUCKETS[4]), None)
+
+    replacements, swapEquities, strength = getFlopSwapEquities(boardCards, handCards)
+    swapEVs = swapEquities.mean(axis=1)
+    bucket = getBucket(strength, NUM_BUCKETS[3])
+    if swapEVs.max() > strength + min_improvement:
+        return (bucket, (True, int(np.argmax(swapEVs))))
+    return (bucket, (False, None))
+
+
+def _initWorker():
+    # the parent's executor threads don't survive the fork, and each process only needs one
+    cfr.EQUITY_EXECUTOR = EquityExecutor(1, EQUITY_BACKENDS[cfr.EQUITY_BACKEND].Calculator)
+
+
+def measureState(state):
+    """
+    Worker: gets the bucket and discard errors (0 or 1) of a state for every candidate iteration count.
+    Returns: (board size, bucket errors, discard errors), with no discard errors on the turn
+    """
+    hand, board = state
+    exactBucket, exactDiscard = getExactAnswers(hand, board)
+    handstr, boardstr = convertSyntax(hand), convertSyntax(board)
+
+    bucketErrors, discardErrors = [], []
+    for iters in CANDIDATE_ITERS:
+        EQUITY_CACHE.Entries.clear() # every estimate has to be sampled fresh
+        bucket = getHandStrengthBuckets([handstr], boardstr, NUM_BUCKETS[len(board)], max_iters=iters)[0][0]
+        bucketErrors.append(int(bucket != exactBucket))
+        if exactDiscard != None:
+            shouldDiscard, discardIndex = determineBestDiscardFast(hand, board, iters=iters, original_iters=10*iters)[0:2]
+            discardErrors.append(int((shouldDiscard, discardIndex) != exactDiscard))
+    return (len(board), bucketErrors, discardErrors)
+
+
+def recommendIters(error_rates, max_error):
+    """
+    Gets the smallest candidate iteration count whose error rate is within max_error of the lowest one.
+    """
+    best = min(error_rates)
+    return [CANDIDATE_ITERS[i] for i in range(len(CANDIDATE_ITERS)) if error_rates[i] <= best + max_error][0]
+
+
+def calibrate(num_states=200, max_error=0.02, processes=None, filename=CONFIG_FILE):
+    """
+    Measures the error rates of num_states random states per street, and writes the recommended settings to filename.
+    """
+    time0 = time.time()
+    states = [dealState(boardSize) for boardSize in STREETS for i in range(num_states)]
+    pool = Pool(processes, _initWorker)
+    try:
+        results = pool.map(measureState, states, chunksize=1)
+    finally:
+        pool.terminate()
+
+    config = {"iters": {"bucket": {}, "discard_swap": {}, "discard_original": {}}, "error_rates": {}, "candidate_iters": CANDIDATE_ITERS}
+    for boardSize, street in STREETS.items():
+        bucketRates = np.mean([r[1] for r in results if r[0] == boardSize], axis=0).tolist()
+        config["error_rates"][street] = {"bucket": bucketRates}
+        config["iters"]["bucket"][boardSize] = recommendIters(bucketRates, max_error)
+        print "%s bucket error rates:  %s" % (street.upper(), " ".join(["%d:%.3f" % x for x in zip(CANDIDATE_ITERS, bucketRates)]))
+
+        # determineBestDiscardFast is exact on the turn, so only the flop's discard settings are sampled
+        if boardSize == 3:
+            discardRates = np.mean([r[2] for r in results if r[0] == boardSize], axis=0).tolist()
+            config["error_rates"][street]["discard"] = discardRates
+            discardIters = recommendIters(discardRates, max_error)
+            config["iters"]["discard_swap"][boardSize] = discardIters
+            config["iters"]["discard_original"][boardSize] = 10 * discardIters
+            print "%s discard error rates: %s" % (street.upper(), " ".join(["%d:%.3f" % x for x in zip(CANDIDATE_ITERS, discardRates)]))
+
+    with open(filename, 'w') as f:
+        json.dump(config, f, indent=1)
+    print "Wrote", config["iters"], "to", filename
+    print "Took", time.time()-time0, "secs"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Calibrates the equity iteration counts that cfr.py uses on each street.', add_help=False, prog='calibrate_iters')
+    parser.add_argument('--states', type=int, default=200, help='Random states to measure per street')
+    parser.add_argument('--max-error', type=float, default=0.02, help='Allowed error rate above the lowest one measured')
+    parser.add_argument('--processes', type=int, default=None, help='Worker processes (default: one per core)')
+    args = parser.parse_args()
+    calibrate(args.states, args.max_error, args.processes)
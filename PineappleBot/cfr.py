@@ -5,11 +5,25 @@ from pokereval.card import Card
 from pokereval.hand_evaluator import HandEvaluator
 from numpy.random import choice
 from numpy import var, std, mean
+import numpy as np
 from random import shuffle
 from itertools import combinations
 from operator import attrgetter
+from collections import OrderedDict
 import os
+import json
+import pbots_calc
+import numpy_calc
 from pbots_calc import calc, Results
+from parallel_calc import EquityExecutor
+from shared_cache import SharedEquityCache
+from lru import LRUCache
+from isomorphism import getCanonicalKey, cardToIndex, cardsToIndices, getPreflopClassIndex, getPreflopClassName, indicesToString, canonicalize, uncanonicalize, applySuitPermutation, SUIT_PERMUTATIONS
+from handeval import evaluate, evaluateOne
+from board_context import BoardContext, TurnContext, getFlopSwapEquities, getHandStrengthMoments, HOLDING_PAIRS, HOLDINGS_WITH_POSITION
+from equity_matrix import HOLDINGS, HOLDING_INDEX, HOLDING_USES_CARD
+from sampling import sampleSwapEquities
+from discard_table import loadDiscardTable, buildDiscardTable, getDiscardAwareEquity, loadDiscardPolicyTable, buildDiscardPolicyTable, getDiscardPolicy
 from copy import deepcopy
 
 
@@ -59,33 +73,471 @@ class Dealer(object):
         return self.deck
 
 
+class EquityCache(object):
+    """
+    A bounded LRU cache of hand strengths, keyed on the canonical form of (hand, board, iters).
+    The contents can be saved to and loaded from a json file, so that training and matches start warm.
+    It can also sit in front of a SharedEquityCache (see attachShared), which other processes read and fill too.
+    """
+    def __init__(self, max_size=500000, filename="equityCache.json"):
+        """
+        max_size: the max number of entries to hold before evicting the least recently used one
+        filename: the json file that the cache is loaded from and saved to
+        """
+        self.Filename = filename
+        self.Entries = LRUCache(max_size)
+        self.Shared = None
+        self.Hits = 0
+        self.Misses = 0
+
+    def attachShared(self, shared):
+        """
+        Backs this cache with a SharedEquityCache: local misses are looked up there, and new entries are added to it.
+        """
+        self.Shared = shared
+
+    def get(self, key):
+        """
+        Returns the cached hand strength for key, or None if it isn't in the cache.
+        """
+        value = self.Entries.get(key)
+        if value != None:
+            self.Hits += 1
+            return value
+
+        value = None if self.Shared == None else self.Shared.get(key)
+        if value != None:
+            self.Hits += 1
+            self.put(key, value, shared=False)
+        else:
+            self.Misses += 1
+        return value
+
+    def put(self, key, value, shared=True):
+        """
+        Adds an entry to the cache, evicting the least recently used entry if the cache is full.
+        shared: whether to also add it to the attached SharedEquityCache (if there is one)
+        """
+        if shared and self.Shared != None:
+            self.Shared.put(key, value)
+        self.Entries.put(key, value)
+
+    def load(self, filename=None):
+        """
+        Loads entries from a json file (least recently used first). Returns whether the load succeeded.
+        The entries are only added locally, not to an attached SharedEquityCache, which keeps its own file.
+        """
+        filename = self.Filename if filename == None else filename
+        try:
+            with open(filename) as f:
+                for key, value in json.load(f):
+                    self.put(key, value, shared=False)
+            return True
+        except (IOError, ValueError):
+            return False
+
+    def save(self, filename=None):
+        """
+        Writes all entries to a json file, in order from least to most recently used.
+        """
+        filename = self.Filename if filename == None else filename
+        with open(filename, 'w') as f:
+            json.dump(self.Entries.items(), f)
+        if self.Shared != None:
+            self.Shared.flush()
+
+    def getHitRate(self):
+        lookups = self.Hits + self.Misses
+        return (float(self.Hits) / lookups) if lookups > 0 else 0.0
+
+    def printStats(self):
+        print "EQUITY CACHE: entries:%d hits:%d misses:%d hit rate:%.3f" % (len(self.Entries), self.Hits, self.Misses, self.getHitRate())
+        if self.Shared != None:
+            self.Shared.printStats()
+
+
+def loadPreflopEquityTable(filename=os.path.join(os.path.dirname(os.path.abspath(__file__)), "preflop_equity.txt")):
+    """
+    Loads the exact preflop equities of the 169 hand classes (see writePreflopEquityTable in misc/write_files.py)
+    into a flat list indexed by isomorphism.getPreflopClassIndex().
+    """
+    equities = []
+    with open(filename) as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            elif line.startswith("VERSION"):
+                assert int(line.split()[1]) == PREFLOP_EQUITY_VERSION, "Error: %s has the wrong table version" % filename
+            else:
+                equities.append(float(line.split()[1]))
+    assert len(equities) == 169, "Error: expected 169 preflop classes, found %d" % len(equities)
+    return equities
+
+
+def loadEquityConfig(filename=os.path.join(os.path.dirname(os.path.abspath(__file__)), "equity_config.json")):
+    """
+    Loads the per-street iteration counts recommended by calibrate_iters.py into EQUITY_ITERS, if the file exists.
+    Settings that aren't in the file keep their defaults.
+    """
+    if not os.path.isfile(filename):
+        return False
+    with open(filename) as f:
+        config = json.load(f)
+    for setting, streets in config["iters"].items():
+        assert setting in EQUITY_ITERS, "Error: unknown equity setting %s in %s" % (setting, filename)
+        for boardSize, iters in streets.items():
+            EQUITY_ITERS[setting][int(boardSize)] = int(iters)
+    return True
+
+
+# shared by every hand strength lookup in this process
+EQUITY_CACHE = EquityCache()
+
+# equity backends by name: modules with a calc() function, a Calculator class and an AVAILABLE flag
+EQUITY_BACKENDS = OrderedDict([("pbots_calc", pbots_calc), ("numpy", numpy_calc)])
+
+
+def setEquityBackend(name):
+    """
+    Switches every equity calculation in this module (CALCULATOR and EQUITY_EXECUTOR) to the named backend.
+    The native pbots_calc library releases the GIL, so it gets a thread per core. The numpy backend holds
+    the GIL for most of its work, so it gets a single worker thread.
+    """
+    global EQUITY_BACKEND, CALCULATOR, EQUITY_EXECUTOR
+    assert name in EQUITY_BACKENDS, "Error: unknown equity backend %s" % name
+    assert EQUITY_BACKENDS[name].AVAILABLE, "Error: equity backend %s is not available on this machine" % name
+
+    if EQUITY_EXECUTOR != None:
+        EQUITY_EXECUTOR.close()
+    EQUITY_BACKEND = name
+    CALCULATOR = EQUITY_BACKENDS[name].Calculator() # reuses its result buffers across calls
+    EQUITY_EXECUTOR = EquityExecutor(None if name == "pbots_calc" else 1, EQUITY_BACKENDS[name].Calculator)
+
+
+# pick the backend at startup: the native pbots_calc library if it loaded, otherwise numpy
+EQUITY_BACKEND = None
+CALCULATOR = None
+EQUITY_EXECUTOR = None
+setEquityBackend("pbots_calc" if pbots_calc.AVAILABLE else "numpy")
+
+# bump this whenever the format or contents of preflop_equity.txt change
+PREFLOP_EQUITY_VERSION = 1
+PREFLOP_EQUITY = loadPreflopEquityTable()
+
+# iteration counts of sampled flop (3) and turn (4) equities, keyed by board size
+#   bucket: max_iters of getHandStrengthBuckets
+#   discard_swap: iters of each swap candidate in determineBestDiscardFast (flop only, the turn is exact)
+#   discard_original: iters of the original hand in determineBestDiscardFast (flop only)
+# equity_config.json (written by calibrate_iters.py) overrides these at startup
+EQUITY_ITERS = {"bucket": {3: 1000, 4: 1000}, "discard_swap": {3: 100}, "discard_original": {3: 1000}}
+loadEquityConfig()
+
+# memory-map the offline discard-aware equity and discard policy tables if they have been built (see misc/write_files.py)
+loadDiscardTable(3)
+loadDiscardTable(4)
+loadDiscardPolicyTable(3)
+loadDiscardPolicyTable(4)
+
+# number of hand strength buckets that convertHtoI uses on each street, keyed by board size
+NUM_BUCKETS = {0: 3, 3: 4, 4: 3, 5: 4}
+
+# the most recently used BoardContexts, so that hands on the same river board share one
+BOARD_CONTEXTS = LRUCache(64)
+
+
+def getBoardContext(board):
+    """
+    Gets the BoardContext for a 5 card board (a list of card ints), building it if it isn't cached.
+    """
+    return BOARD_CONTEXTS.getOrBuild(tuple(sorted(board)), lambda: BoardContext(board))
+
+
+# TurnContexts take ~50 BoardContexts to build, so only the last few turn boards are kept (the live bot needs one per hand)
+TURN_CONTEXTS = LRUCache(4)
+
+
+def getTurnContext(board):
+    """
+    Gets the TurnContext for a 4 card board (a list of card ints), building it if it isn't cached.
+    """
+    return TURN_CONTEXTS.getOrBuild(tuple(sorted(board)), lambda: TurnContext(board))
+
+
+def getTurnHandStrength(hand, board, dead=None):
+    """
+    Gets the exact hand strength of a hand on a 4 card board, over every river card and opponent holding,
+    using the board's TurnContext. Building the context costs about as much as one 1000 iteration pbots_calc
+    call per river card, so this pays off when the same turn board is queried several times (i.e the live bot).
+    hand: a list of 2 card ints
+    board: a list of 4 card ints
+    dead: an optional card int that nobody can hold (i.e a card we just discarded)
+    """
+    assert len(board) == 4, "Error: exact turn strength needs a 4 card board"
+    return getTurnContext(board).getEquity(hand, dead)
+
+
+def getRiverHandStrength(hand, board):
+    """
+    Gets the exact hand strength of a hand on a complete (5 card) board against all 990 possible opponent
+    holdings, using the board's BoardContext. Wins count 1 and ties count 0.5, just like pbots_calc's EV.
+    hand: a list of 2 card ints
+    board: a list of 5 card ints
+    """
+    assert len(board) == 5, "Error: exact river strength needs a 5 card board"
+    return getBoardContext(board).getEquity(hand)
+
+
+def toCalcStrings(hand, board):
+    """
+    Converts a hand and board (lists of Card objects, or strings already) into pbots_calc syntax.
+    """
+    if ((type(hand) == str) and (type(board) == str)):
+        return (hand, board)
+
+    else:
+        assert len(board) <= 5, "Error: board must have 3-5 cards"
+        assert (len(hand)==2), "Error: hand must contain exactly 2 cards"
+        return (convertSyntax(hand), convertSyntax(board))
+
+
 def getHandStrength(hand, board, iters=1000):
     """
     Uses pbots calc library to get the hand strength of a given hand against a given board.
     hand: a list of 2 Card objects
     board: a list of Card objects (could be [] or contain up to 5 cards)
+
+    Preflop (empty board) strengths are exact, and come straight from the PREFLOP_EQUITY table.
+    River (5 card board) strengths are exact too, see getRiverHandStrength(); iters is ignored for both.
+    Other results are memoized in EQUITY_CACHE, so repeated (hand, board) pairs (up to suit isomorphism) only hit pbots_calc once.
     
     With iters=500: 95% of data within 3.8% of actual
     With iters=1000: 95% of data within 2.7% of actual
     With iters=2000: 95% of data within 2.2% of actual
     With iters=4000: 95% of data within 1.7% of actual
     """
-    if ((type(hand) == str) and (type(board) == str)):
-        #print hand, board
-        res = calc(hand+":xx", board, "", iters)
+    handstr, boardstr = toCalcStrings(hand, board)
 
-    else:
-        assert len(board) <= 5, "Error: board must have 3-5 cards"
-        assert (len(hand)==2), "Error: hand must contain exactly 2 cards"
+    if boardstr == "":
+        return PREFLOP_EQUITY[getPreflopClassIndex(cardsToIndices(handstr))]
+    elif len(boardstr) == 10:
+        return getRiverHandStrength(cardsToIndices(handstr), cardsToIndices(boardstr))
+
+    key = "%s|%d" % (getCanonicalKey(handstr, boardstr), iters)
+    strength = EQUITY_CACHE.get(key)
 
+    if strength == None:
         # the "xx" tells pbots_calc to compare hand against a random opponent hand
-        handstr = convertSyntax(hand)+":xx"
-        boardstr = convertSyntax(board)
+        # note the empty "" parameter is telling pbots_calc not to remove any extra cards from the deck
+        strength = CALCULATOR.calc(handstr+":xx", boardstr, "", iters).ev[0] # the EV of our hand
+        EQUITY_CACHE.put(key, strength)
 
-        #note the empty "" parameter is telling pbots_calc not to remove any extra cards from the deck
-        res = calc(handstr, boardstr, "", iters)
-    
-    return res.ev[0] # return the EV of our hand
+    return strength
+
+
+def getDiscardAwareHandStrength(hand, board):
+    """
+    Gets the hand strength of a hand on a flop or turn board, assuming its owner plays the coming discard round well
+    (the best of keeping the hand or swapping either card, see discard_table.py). Comes from the offline discard
+    tables when they have been built, and is computed for just this hand otherwise.
+    hand: a list of 2 Card objects
+    board: a list of 3 or 4 Card objects
+    """
+    handstr, boardstr = toCalcStrings(hand, board)
+    assert len(boardstr) == 6 or len(boardstr) == 8, "Error: discard-aware strength needs a flop or turn board"
+    return getDiscardAwareEquity(cardsToIndices(handstr), cardsToIndices(boardstr))
+
+
+class PendingHandStrength(object):
+    """
+    A hand strength that may still be computing on EQUITY_EXECUTOR (see getHandStrengthAsync).
+    """
+    def __init__(self, key, strength=None, async_result=None):
+        self.Key = key
+        self.Strength = strength
+        self.AsyncResult = async_result
+
+    def get(self):
+        """
+        Waits for the hand strength if needed, and returns it. The result is added to EQUITY_CACHE here
+        (on the calling thread) since the cache is not thread-safe.
+        """
+        if self.Strength == None:
+            self.Strength = self.AsyncResult.get()[0]
+            EQUITY_CACHE.put(self.Key, self.Strength)
+        return self.Strength
+
+
+def getHandStrengthAsync(hand, board, iters=1000):
+    """
+    Same as getHandStrength(), but starts the pbots_calc query on EQUITY_EXECUTOR and returns a PendingHandStrength
+    right away, so that several strengths can be computed at once. Call get() on the result to wait for it.
+    """
+    handstr, boardstr = toCalcStrings(hand, board)
+
+    if boardstr == "":
+        return PendingHandStrength(None, PREFLOP_EQUITY[getPreflopClassIndex(cardsToIndices(handstr))])
+    elif len(boardstr) == 10:
+        return PendingHandStrength(None, getRiverHandStrength(cardsToIndices(handstr), cardsToIndices(boardstr)))
+
+    key = "%s|%d" % (getCanonicalKey(handstr, boardstr), iters)
+    strength = EQUITY_CACHE.get(key)
+
+    if strength == None:
+        return PendingHandStrength(key, async_result=EQUITY_EXECUTOR.submit(handstr+":xx", boardstr, "", iters))
+    else:
+        return PendingHandStrength(key, strength)
+
+
+def getHandStrengthMany(hands, board, iters=1000):
+    """
+    Gets the hand strengths of many hands (pbots_calc strings) on the same flop or turn board (a pbots_calc string).
+    Cached strengths are reused, and the rest are computed in parallel on EQUITY_EXECUTOR and added to EQUITY_CACHE.
+    Returns: a float array with the strength of each hand
+    """
+    keys = ["%s|%d" % (getCanonicalKey(h, board), iters) for h in hands]
+    strengths = np.array([EQUITY_CACHE.get(k) for k in keys], dtype=np.float64) # None -> NaN
+    missing = np.nonzero(np.isnan(strengths))[0]
+
+    if len(missing) > 0:
+        strengths[missing] = EQUITY_EXECUTOR.calc_many([(hands[i]+":xx", board, "", iters) for i in missing])[:, 0]
+        for i in missing:
+            EQUITY_CACHE.put(keys[i], strengths[i])
+    return strengths
+
+
+def getHandStrengthAdaptive(hand, board, tolerance=0.02, chunk_iters=100, max_iters=4000, z=1.96):
+    """
+    Like getHandStrength(), but samples in chunks of chunk_iters and stops as soon as the estimate is within
+    tolerance of the true EV (with confidence given by z, 1.96 -> 95%), or after max_iters.
+    Obvious hands stop after a chunk or two, coin flips use the most iterations.
+
+    Each outcome is between 0 and 1, so its variance is at most p(1-p). p is smoothed with (total+1)/(n+2)
+    so that a run of all wins or all losses doesn't stop the sampling with a bound of zero.
+
+    Returns: (estimate, iters_used, bound), where bound is the half width of the confidence interval.
+    Preflop and river strengths are exact and come back as (strength, 0, 0.0).
+    """
+    handstr, boardstr = toCalcStrings(hand, board)
+
+    if boardstr == "" or len(boardstr) == 10:
+        return (getHandStrength(handstr, boardstr), 0, 0.0)
+
+    # every setting changes the estimate, so a result is only reused for the same ones
+    key = "%s|tol=%g|c%d|m%d|z=%g" % (getCanonicalKey(handstr, boardstr), tolerance, chunk_iters, max_iters, z)
+    cached = EQUITY_CACHE.get(key)
+    if cached != None:
+        return tuple(cached)
+
+    total, n, bound = 0.0, 0, 1.0
+    while n < max_iters:
+        iters = min(chunk_iters, max_iters - n)
+        result = CALCULATOR.calc(handstr+":xx", boardstr, "", iters)
+        if not result.MC_used: # pbots_calc enumerated every outcome, so this is exact
+            total, n, bound = result.ev[0] * result.iters, result.iters, 0.0
+            break
+
+        total += result.ev[0] * result.iters
+        n += result.iters
+        p = (total + 1.0) / (n + 2.0)
+        bound = z * (p * (1.0 - p) / n) ** 0.5
+        if bound <= tolerance:
+            break
+
+    estimate = (total / n, n, bound)
+    EQUITY_CACHE.put(key, list(estimate))
+    return estimate
+
+
+def getBucket(strength, nbuckets):
+    """
+    Maps a hand strength to one of nbuckets equal width buckets, the same way convertHtoI does.
+    """
+    return min(int(strength*nbuckets), nbuckets-1)
+
+
+def getHandStrengthBuckets(hands, board, nbuckets, chunk_iters=100, max_iters=None, z=1.96, dead=""):
+    """
+    Gets the hand strength bucket of several hands on the same board, without computing each strength to full precision.
+    Every round, one chunk of chunk_iters is sampled for each unresolved hand (in parallel on EQUITY_EXECUTOR).
+    A hand is resolved once its confidence interval (see getHandStrengthAdaptive) sits inside a single bucket,
+    or after max_iters (default: EQUITY_ITERS["bucket"] for the street). A max_iters below chunk_iters shrinks the chunks
+    to max_iters. Preflop and river strengths are exact, so they resolve right away.
+
+    hands: a list of hands (lists of Card objects or pbots_calc strings)
+    board: a list of Card objects or a pbots_calc string
+    dead: a pbots_calc string of cards that nobody can hold, for every hand (i.e a card that was just discarded).
+          Only used on the flop and turn, since nobody discards on the river.
+    Returns: (buckets, estimates), where estimates[i] is a strength that falls in buckets[i] (to use in History strings)
+    """
+    handstrs = [toCalcStrings(hand, board)[0] for hand in hands]
+    boardstr = toCalcStrings(hands[0], board)[1] if len(hands) > 0 else ""
+    if max_iters == None:
+        max_iters = EQUITY_ITERS["bucket"].get(len(boardstr) // 2)
+    if max_iters != None:
+        chunk_iters = min(chunk_iters, max_iters) # so that a hand never gets more than max_iters
+
+    estimates = [None] * len(hands)
+    keys = [None] * len(hands)
+    for i in range(len(hands)):
+        if boardstr == "" or len(boardstr) == 10:
+            estimates[i] = getHandStrength(handstrs[i], boardstr)
+        else:
+            # the sampling settings change which estimate a hand resolves to, so they're part of the key
+            keys[i] = "%s|b%d|c%d|m%d|z=%g" % (getDeadCardKey(handstrs[i], boardstr, dead), nbuckets, chunk_iters, max_iters, z)
+            estimates[i] = EQUITY_CACHE.get(keys[i])
+
+    unresolved = [i for i in range(len(hands)) if estimates[i] == None]
+    totals = dict([(i, 0.0) for i in unresolved])
+    counts = dict([(i, 0) for i in unresolved])
+    while len(unresolved) > 0:
+        evs = EQUITY_EXECUTOR.calc_many([(handstrs[i]+":xx", boardstr, dead, chunk_iters) for i in unresolved])
+
+        stillUnresolved = []
+        for j in range(len(unresolved)):
+            i = unresolved[j]
+            totals[i] += evs[j, 0] * chunk_iters
+            counts[i] += chunk_iters
+
+            estimate = totals[i] / counts[i]
+            p = (totals[i] + 1.0) / (counts[i] + 2.0)
+            bound = z * (p * (1.0 - p) / counts[i]) ** 0.5
+            if getBucket(max(estimate - bound, 0.0), nbuckets) == getBucket(min(estimate + bound, 1.0), nbuckets) or counts[i] >= max_iters:
+                estimates[i] = estimate
+                EQUITY_CACHE.put(keys[i], estimate)
+            else:
+                stillUnresolved.append(i)
+        unresolved = stillUnresolved
+
+    return ([getBucket(e, nbuckets) for e in estimates], estimates)
+
+
+def getDeadCardKey(handstr, boardstr, dead):
+    """
+    Gets the canonical key of a hand and board (see getCanonicalKey) with some dead cards, in pbots_calc syntax.
+    The dead cards are relabeled with the same suit permutation as the hand and board.
+    """
+    if dead == "":
+        return getCanonicalKey(handstr, boardstr)
+    canonicalHand, canonicalBoard, perm = canonicalize(cardsToIndices(handstr), cardsToIndices(boardstr))
+    canonicalDead = sorted(applySuitPermutation(cardsToIndices(dead), perm), reverse=True)
+    return "%s|%s|dead=%s" % (indicesToString(canonicalHand), indicesToString(canonicalBoard), indicesToString(canonicalDead))
+
+
+def getHandStrengthBucket(hand, board, nbuckets, chunk_iters=100, max_iters=None):
+    """
+    Gets the hand strength bucket (0 to nbuckets-1) of a single hand, sampling only until the bucket is known.
+    See getHandStrengthBuckets().
+    """
+    return getHandStrengthBuckets([hand], board, nbuckets, chunk_iters, max_iters)[0][0]
+
+
+def getLazyBucketStrength(hand, board, dead=""):
+    """
+    Gets a LazyHandStrength for a hand on a flop or turn board (pbots_calc strings), which samples only until the
+    hand's NUM_BUCKETS bucket is known when it's read (see getHandStrengthBuckets).
+    dead: a pbots_calc string of cards that nobody can hold (i.e the card the hand just discarded)
+    """
+    return LazyHandStrength(lambda: getHandStrengthBuckets([hand], board, NUM_BUCKETS[len(board) // 2], dead=dead)[1][0])
 
 
 def determineWinner(p1_hand, p2_hand, board):
@@ -96,21 +548,141 @@ def determineWinner(p1_hand, p2_hand, board):
     3: Players tie
     """
     assert len(board)==5, "Error: cannot determine winner on a board with less than 5 cards"
-    handstr = "%s:%s" % (convertSyntax(p1_hand), convertSyntax(p2_hand))
-    boardstr = convertSyntax(board)
+    boardCards = cardsToIndices(board)
+    p1_rank = evaluateOne(cardsToIndices(p1_hand) + boardCards)
+    p2_rank = evaluateOne(cardsToIndices(p2_hand) + boardCards)
 
-    res = calc(handstr, boardstr, "", 1)
-
-    if abs(res.ev[0]-1.0) < 0.01:
+    if p1_rank > p2_rank:
         return 0
-    elif abs(res.ev[1]-1.0) < 0.01:
+    elif p2_rank > p1_rank:
         return 1
     else:
-        # print " ----------- Tie?--------------"
-        # print "P1:%f P2: %f" % (res.ev[0], res.ev[1])
         return 3 # tie player
 
 
+def toCardArray(hands):
+    """
+    Converts a list of hands (each a list of Card objects, a pbots_calc string or a list of card ints)
+    into an int array of shape (N, cards per hand) that the batch functions below can use.
+    """
+    if isinstance(hands, np.ndarray):
+        return hands
+    return np.array([h if (len(h) == 0 or type(h[0]) == int) else cardsToIndices(h) for h in hands], dtype=np.int64)
+
+
+def rankHandsBatch(cards):
+    """
+    Ranks many 5-7 card hands at once using the handeval lookup tables (no pbots_calc calls).
+    cards: a list of hands, or an int array of shape (N, 7)
+    Returns: an int array of shape (N,) where higher ranks are better hands
+    """
+    return evaluate(toCardArray(cards))
+
+
+def determineWinnerBatch(p1_hands, p2_hands, boards):
+    """
+    Vectorized version of determineWinner() for a batch of river showdowns.
+    p1_hands, p2_hands: lists of 2 card hands, or int arrays of shape (N, 2)
+    boards: a list of 5 card boards, or an int array of shape (N, 5)
+    Returns: an int array of shape (N,) with 0 (P1 wins), 1 (P2 wins) or 3 (tie) for each showdown
+    """
+    boards = toCardArray(boards)
+    p1_ranks = evaluate(np.concatenate([toCardArray(p1_hands), boards], axis=1))
+    p2_ranks = evaluate(np.concatenate([toCardArray(p2_hands), boards], axis=1))
+    return np.where(p1_ranks > p2_ranks, 0, np.where(p2_ranks > p1_ranks, 1, 3))
+
+
+def sampleUnknownCards(excluded, num_cards):
+    """
+    For each row of excluded (a bool array of shape (N, 52) marking cards that can't be dealt),
+    deals num_cards distinct random cards from the rest of the deck.
+    Returns: an int array of shape (N, num_cards)
+    """
+    keys = np.random.random_sample(excluded.shape)
+    keys[excluded] = 2.0 # excluded cards sort after every card that can be dealt
+    dealt = np.argpartition(keys, num_cards, axis=1)[:, 0:num_cards]
+
+    # argpartition leaves the dealt cards in an order that depends on the card ints, so put them in key order
+    order = np.argsort(np.take_along_axis(keys, dealt, axis=1), axis=1)
+    return np.take_along_axis(dealt, order, axis=1)
+
+
+def getHandStrengthBatch(hands, board, iters=1000):
+    """
+    Vectorized getHandStrength() for many hands against the same board, with no pbots_calc calls.
+    Each hand is played against iters random opponent hands and runouts (or every opponent hand on a 5 card board).
+    hands: a list of 2 card hands, or an int array of shape (H, 2)
+    board: a list of 0-5 Card objects or card ints
+    Returns: a float array of shape (H,) with the EV of each hand
+    """
+    hands = toCardArray(hands)
+    boardCards = cardsToIndices(board) if (len(board) > 0 and type(board[0]) != int) else list(board)
+    numHands = len(hands)
+
+    if len(boardCards) == 5:
+        return getBoardContext(boardCards).getEquities(hands)
+
+    # one row per (hand, iteration)
+    rows = np.repeat(hands, iters, axis=0)
+    excluded = np.zeros((len(rows), 52), dtype=bool)
+    excluded[np.arange(len(rows))[:, None], rows] = True
+    excluded[:, boardCards] = True
+
+    dealt = sampleUnknownCards(excluded, 7 - len(boardCards))
+    fullBoards = np.concatenate([np.tile(np.array(boardCards, dtype=np.int64), (len(rows), 1)), dealt[:, 2:]], axis=1)
+    ourRanks = evaluate(np.concatenate([rows, fullBoards], axis=1))
+    oppRanks = evaluate(np.concatenate([dealt[:, 0:2], fullBoards], axis=1))
+
+    outcomes = (ourRanks > oppRanks) + 0.5*(ourRanks == oppRanks)
+    return outcomes.reshape(numHands, iters).mean(axis=1)
+
+
+def getRangeEquity(hand, board, weights, iters=1000):
+    """
+    Gets the equity of a hand against an opponent range instead of a uniformly random hand.
+    hand: a list of 2 card ints
+    board: a list of 0-5 card ints
+    weights: a length 1326 array with the (relative) weight of each opponent holding, indexed like equity_matrix.HOLDINGS
+        (holdings that use one of our cards or a board card are ignored)
+
+    On the river this is exact, in one pass over the board's BoardContext ranks. On the turn it is exact too if the
+    board's TurnContext is already cached (i.e in the live bot). Otherwise it is vectorized Monte Carlo: iters opponent
+    holdings are drawn from the range, each with a random runout.
+    """
+    hand, board = list(hand), list(board)
+    weights = np.asarray(weights, dtype=np.float64)
+    blocked = HOLDING_USES_CARD[:, hand + board].any(axis=1)
+
+    if len(board) == 5 or (len(board) == 4 and tuple(sorted(board)) in TURN_CONTEXTS):
+        contexts = [getBoardContext(board)] if len(board) == 5 else getTurnContext(board).Contexts
+        wins = total = 0.0
+        for context in contexts:
+            if context.Board[-1] in hand and len(board) == 4:
+                continue # this river card is one of our cards
+            ourRank = context.getRanks([hand])[0]
+            indices = HOLDING_INDEX[context.Holdings[:, 0], context.Holdings[:, 1]]
+            holdingWeights = np.where(blocked[indices], 0.0, weights[indices])
+            wins += np.dot(holdingWeights, (context.Ranks < ourRank) + 0.5*(context.Ranks == ourRank))
+            total += holdingWeights.sum()
+        assert total > 0, "Error: the opponent range has no weight on holdings that are still possible"
+        return wins / total
+
+    # draw opponent holdings from the range, then deal each one a runout from the rest of the deck
+    holdingWeights = np.where(blocked, 0.0, weights)
+    assert holdingWeights.sum() > 0, "Error: the opponent range has no weight on holdings that are still possible"
+    opponents = HOLDINGS[np.random.choice(len(HOLDINGS), size=iters, p=holdingWeights/holdingWeights.sum())]
+
+    excluded = np.zeros((iters, 52), dtype=bool)
+    excluded[:, hand + board] = True
+    excluded[np.arange(iters)[:, None], opponents] = True
+    runouts = sampleUnknownCards(excluded, 5 - len(board))
+
+    fullBoards = np.concatenate([np.tile(np.array(board, dtype=np.int64), (iters, 1)), runouts], axis=1)
+    ourRanks = evaluate(np.concatenate([np.tile(np.array(hand, dtype=np.int64), (iters, 1)), fullBoards], axis=1))
+    oppRanks = evaluate(np.concatenate([opponents, fullBoards], axis=1))
+    return float(np.mean((ourRanks > oppRanks) + 0.5*(ourRanks == oppRanks)))
+
+
 def convertSyntax(cards):
     """
     Converts a list of Card objects to correct syntax for pbots_calc
@@ -134,42 +706,27 @@ def determineBestDiscard(hand, board, min_improvement=0.05, iters=100):
     hand: a list of Card objects
     board: a list of Card objects
     """
-    originalHandStr = convertSyntax(hand)+":xx"
+    originalHandStr = convertSyntax(hand)
     boardstr = convertSyntax(board)
 
-    originalHandEV = calc(originalHandStr, boardstr, "", 1000).ev[0]
-
-    swapFirstEVSum = 0
-    swapSecondEVSum = 0
-    numCards = 0
+    originalHandEV = getHandStrengthAsync(originalHandStr, boardstr, 1000)
 
+    # compare original hand to the hands made by replacing the first or second card with each CARD
+    swapHands = []
     for card in FULL_DECK:
         if card in board or card in hand:
             continue
         else:
-            # increment
-            numCards += 1
-
             cardstr = convertSyntax(card)
+            swapHands.append(cardstr+originalHandStr[2:4])
+            swapHands.append(originalHandStr[0:2]+cardstr)
 
-            # compare original hand to the hand made by replacing first card with CARD
-            swapFirstStr = "%s%s%s" % (cardstr,originalHandStr[2:4],":xx")
-
-            # compare original hand to the hand made by replacing second card with CARD
-            swapSecondStr = "%s%s%s" % (originalHandStr[0:2],cardstr,":xx")
-
-            # print("First:", swapFirstStr)
-            # print("Second:", swapSecondStr)
-
-            swap_first_res = calc(swapFirstStr, boardstr, "", iters)
-            swap_second_res = calc(swapSecondStr, boardstr, "", iters)
-
-            swapFirstEVSum += swap_first_res.ev[0]
-            swapSecondEVSum += swap_second_res.ev[0]
+    swapEVs = getHandStrengthMany(swapHands, boardstr, iters)
+    originalHandEV = float(originalHandEV.get())
 
     # calculate the average EV of swapping first and second when we play them against the original hand
-    avgSwapFirstEV = float(swapFirstEVSum) / numCards
-    avgSwapSecondEV = float(swapSecondEVSum) / numCards
+    avgSwapFirstEV = float(mean(swapEVs[0::2]))
+    avgSwapSecondEV = float(mean(swapEVs[1::2]))
 
     # if either swap increases EV by more than 5%
     if avgSwapFirstEV > originalHandEV+min_improvement or avgSwapSecondEV > originalHandEV+min_improvement:
@@ -219,13 +776,13 @@ def determineBestCardToKeep(hand, board, iters=1000, highcard_weight=0.03):
     #print "Cmp Cards:", cmpCard1Str, cmpCard2Str
 
     # play [C_1, C1*] against [C_2, C2*]
-    res1 = calc("%s%s:%s%s" % (originalHandStr[0:2], cmpCard1Str, originalHandStr[2:4], cmpCard2Str), boardStr, "", iters)
     # play [C_1, C2*] against [C_2, C1*]
-    res2 = calc("%s%s:%s%s" % (originalHandStr[0:2], cmpCard2Str, originalHandStr[2:4], cmpCard1Str), boardStr, "", iters)
+    evs = EQUITY_EXECUTOR.calc_many([("%s%s:%s%s" % (originalHandStr[0:2], cmpCard1Str, originalHandStr[2:4], cmpCard2Str), boardStr, "", iters),
+                                     ("%s%s:%s%s" % (originalHandStr[0:2], cmpCard2Str, originalHandStr[2:4], cmpCard1Str), boardStr, "", iters)])
 
     # determine which card is stronger, and should be kept
-    C1_scores = [res1.ev[0], res2.ev[0]] # the EVs for hands where we KEPT C1
-    C2_scores = [res1.ev[1], res2.ev[1]] # the EVs for hands where we KEPT C2
+    C1_scores = evs[:, 0] # the EVs for hands where we KEPT C1
+    C2_scores = evs[:, 1] # the EVs for hands where we KEPT C2
 
     #print C1_scores
     #print C2_scores
@@ -241,9 +798,12 @@ def determineBestCardToKeep(hand, board, iters=1000, highcard_weight=0.03):
     return keepCard
 
 
-def determineBestDiscardFast(hand, board, min_improvement=0.02, iters=100):
+def determineBestDiscardFast(hand, board, min_improvement=0.02, iters=None, original_iters=None):
     """
     min_improvement: the EV % that swapping must increase our hand by in order to go for the swap
+    iters: the iterations for each swap candidate (default: EQUITY_ITERS["discard_swap"] for the street)
+    original_iters: the iterations for the original hand (default: EQUITY_ITERS["discard_original"] for the street)
+    On the turn the decision is exact instead (see determineBestDiscardTurn()), and the iterations are ignored.
 
     Returns:
     -whether we should swap
@@ -252,31 +812,32 @@ def determineBestDiscardFast(hand, board, min_improvement=0.02, iters=100):
     -the original EV of our hand as is 
     """
 
+    if len(board) == 4:
+        return determineBestDiscardTurn(hand, board, min_improvement)
+
+    iters = iters or EQUITY_ITERS["discard_swap"][len(board)]
+    original_iters = original_iters or EQUITY_ITERS["discard_original"][len(board)]
+
+    # start on the EV of our original hand in the background
+    boardStr = convertSyntax(board)
+    originalHandEV = getHandStrengthAsync(convertSyntax(hand), boardStr, original_iters)
+
     # if we were to keep a card, determine which one is best
     keepCard = determineBestCardToKeep(hand, board)
     #print "Playoff thinks we should discard:", 1-keepCard
 
-    boardStr = convertSyntax(board)
-    originalHandEV = calc("%s:xx" % convertSyntax(hand), boardStr, "", 1000).ev[0]
-
-    numCards = 0
-    swapEVSum = 0
+    # remember, we want to KEEP our keepCard and swap the other card!!!
+    keepCardStr = convertSyntax(hand[keepCard])
+    swapHands = []
     for card in FULL_DECK:
         if card in board or card in hand:
             continue
         else:
-            # increment
-            numCards += 1
-
-            cardstr = convertSyntax(card)
-
-            # remember, we want to KEEP our keepCard and swap the other card!!!
-            swapStr = "%s%s%s" % (cardstr,convertSyntax(hand[keepCard]),":xx")
-            swapRes = calc(swapStr, boardStr, "", iters)
-            swapEVSum += swapRes.ev[0]
+            swapHands.append(convertSyntax(card)+keepCardStr)
 
     # calculate the average EV of swapping the card besides our keepCard
-    avgSwapEV = float(swapEVSum) / numCards
+    avgSwapEV = float(mean(getHandStrengthMany(swapHands, boardStr, iters)))
+    originalHandEV = float(originalHandEV.get())
 
     # if either swap increases EV by more than 5%
     if avgSwapEV > originalHandEV + min_improvement:
@@ -285,6 +846,103 @@ def determineBestDiscardFast(hand, board, min_improvement=0.02, iters=100):
         return (False, None, 0, originalHandEV)
 
 
+def getSwapEVTable(hand, board, runouts=100):
+    """
+    Gets the EV of a hand on a flop or turn board, and of every hand it could become by discarding either card,
+    all in one batch. Exact on the turn (see TurnContext.getSwapEquities). On the flop every hand is scored against
+    every opponent holding on the same sampled runouts (see board_context.getFlopSwapEquities), so the comparisons
+    between hands are much less noisy than separate pbots_calc estimates.
+    hand: a list of 2 Card objects
+    board: a list of 3 or 4 Card objects
+    runouts: the number of (turn, river) runouts to sample on the flop, or None for all 1081 (exact)
+    Returns: (replacements, swapEVs, originalEV) where swapEVs[i][j] is the EV after discarding hand[i] and drawing
+        replacements[j] (card ints)
+    """
+    handCards, boardCards = cardsToIndices(hand), cardsToIndices(board)
+    if len(boardCards) == 4:
+        turnContext = getTurnContext(boardCards)
+        replacements, swapEVs = turnContext.getSwapEquities(handCards)
+        return (replacements, swapEVs, turnContext.getEquity(handCards))
+
+    assert len(boardCards) == 3, "Error: swap EVs need a flop or turn board"
+    return getFlopSwapEquities(boardCards, handCards, runouts)
+
+
+def _chooseDiscard(originalEV, swapEVs, min_improvement):
+    """
+    Makes a discard decision from the EV of keeping a hand and swapEVs, the average EV of discarding each of its cards:
+    discard the card with the best swap EV if that beats keeping the hand by more than min_improvement.
+    Returns: the same tuple as determineBestDiscardFast()
+    """
+    discardIndex = int(np.argmax(swapEVs))
+    if swapEVs[discardIndex] > originalEV + min_improvement:
+        return (True, discardIndex, float(swapEVs[discardIndex]), float(originalEV))
+    else:
+        return (False, None, 0, float(originalEV))
+
+
+def determineBestDiscardFull(hand, board, min_improvement=0.02, runouts=100):
+    """
+    Same as determineBestDiscardFast(), but both cards are scored with the full swap EV table (see getSwapEVTable())
+    instead of picking the card to keep with a playoff.
+    """
+    replacements, swapEVs, originalEV = getSwapEVTable(hand, board, runouts)
+    return _chooseDiscard(originalEV, swapEVs.mean(axis=1), min_improvement)
+
+
+def determineBestDiscardTurn(hand, board, min_improvement=0.02):
+    """
+    The exact discard decision on the turn: every replacement card (46), river card (45) and opponent holding is
+    enumerated for both cards at once, with the ranks in the board's TurnContext (see TurnContext.getSwapEquities).
+    Returns the same tuple as determineBestDiscardFast(). Once the TurnContext is cached (the live bot builds it for
+    the turn hand strength) this takes about 10ms, less than the sampled estimators and without their noise.
+    """
+    assert len(board) == 4, "Error: exact discard decisions need a turn board"
+    return determineBestDiscardFull(hand, board, min_improvement)
+
+
+def determineBestDiscardCRN(hand, board, min_improvement=0.02, iters=200):
+    """
+    Same as determineBestDiscardFast(), but the original hand and every swap candidate of both cards are played against
+    the same iters sampled runouts and opponent hands (see sampling.sampleSwapEquities), so the EV differences that
+    the decision depends on have far lower variance than independent pbots_calc estimates.
+    """
+    replacements, swapEVs, originalEV = sampleSwapEquities(cardsToIndices(hand), cardsToIndices(board), iters)
+    return _chooseDiscard(originalEV, swapEVs.mean(axis=1), min_improvement)
+
+
+def determineBestDiscardAnytime(hand, board, deadline, min_improvement=0.02, round_iters=50, max_iters=4000):
+    """
+    An anytime version of determineBestDiscardCRN(), for when there is a time budget instead of an iteration count.
+    Swap EVs are refined in rounds of round_iters shared samples (averaged with the earlier rounds) until another round
+    (assumed to take as long as the last one) would finish after deadline, or max_iters samples are used, and the
+    decision is made from all the rounds so far. At least one round always runs, which takes a couple of ms.
+    Returns: the same tuple as determineBestDiscardFast(), plus the number of samples used
+    """
+    handCards, boardCards = cardsToIndices(hand), cardsToIndices(board)
+    swapEVs, originalEV, rounds, roundTime = 0.0, 0.0, 0, 0.0
+    while rounds == 0 or (time.time() + roundTime <= deadline and (rounds + 1) * round_iters <= max_iters):
+        time0 = time.time()
+        replacements, roundSwapEVs, roundOriginalEV = sampleSwapEquities(handCards, boardCards, round_iters)
+        swapEVs += roundSwapEVs
+        originalEV += roundOriginalEV
+        rounds += 1
+        roundTime = time.time() - time0
+
+    return _chooseDiscard(originalEV / rounds, swapEVs.mean(axis=1) / rounds, min_improvement) + (rounds * round_iters,)
+
+
+def determineBestDiscardFromTable(hand, board):
+    """
+    Same as determineBestDiscardFull(), but the decision is looked up in the offline discard policy tables
+    (see discard_table.py) instead of sampled. Boards that the tables don't have fall back to determineBestDiscardFull().
+    hand: a list of 2 Card objects
+    board: a list of 3 or 4 Card objects
+    """
+    decision = getDiscardPolicy(cardsToIndices(hand), cardsToIndices(board))
+    return decision if decision != None else determineBestDiscardFull(hand, board)
+
+
 def convertHtoI(history, player):
     """
     Uses predefined abstraction rules to convert a sequency (history) into an information set.
@@ -325,31 +983,23 @@ def convertHtoI(history, player):
         elif s_parsed[0] == "H0":
             numDiscardActions+=1
             if player==0: # we need to update our player's hand
-                if currentSection==1: # flop, 4 buckets
-                    hand = "H%d" % min(int(float(s_parsed[2])*4), 3) # scales hand to an int 0,1,2,3
-                elif currentSection==2: # turn, 3 buckets
-                    hand = "H%d" % min(int(float(s_parsed[2])*3), 2) # scales hand to an int 0,1,2,3
-
-                Current_Player_HS=hand
+                # (strength, number of buckets): flop has 4 buckets, turn has 3
+                Current_Player_HS = (s_parsed[2], 4 if currentSection==1 else 3)
 
         elif s_parsed[0] == "H1":
             numDiscardActions+=1
             if player==1:
-                if currentSection==1: # flop, 4 buckets
-                    hand = "H%d" % min(int(float(s_parsed[2])*4), 3) # scales hand to an int 0,1,2,3
-                elif currentSection==2: # turn, 3 buckets
-                    hand = "H%d" % min(int(float(s_parsed[2])*3), 2) # scales hand to an int 0,1,2,3
-                Current_Player_HS=hand
+                Current_Player_HS = (s_parsed[2], 4 if currentSection==1 else 3)
 
         # if flop or turn, we don't want to add anything yet
         elif s_parsed[0]== "FP" or s_parsed[0]=="TN":
             if s_parsed[0]== "FP": # use 4 hand buckets on flop
                 currentSection=1
-                Current_Player_HS = ("H%d" % min(int(float(s_parsed[3])*4), 3)) if player==0 else ("H%d" % min(int(float(s_parsed[5])*4), 3))
+                Current_Player_HS = (s_parsed[3] if player==0 else s_parsed[5], 4)
 
             elif s_parsed[0]=="TN": # use 3 hand buckets on turn
                 currentSection=2
-                Current_Player_HS = ("H%d" % min(int(float(s_parsed[3])*3), 2)) if player==0 else ("H%d" % min(int(float(s_parsed[5])*3), 2))
+                Current_Player_HS = (s_parsed[3] if player==0 else s_parsed[5], 3)
 
             # set this flag so we start to append discard actions after the flop or turn has happened
             inDiscardSection=True
@@ -416,19 +1066,20 @@ def convertHtoI(history, player):
 
         # decide whether or not we ended a discard section
         # if so, add the player's hand strength to the info set
+        # (it's only bucketed here, so a strength that a discard replaced is never computed, see LazyHandStrength)
         if inDiscardSection:
             if numDiscards==2 and numDiscardActions == 4:
-                infoset_str += Current_Player_HS
+                infoset_str += "H%d" % getBucket(float(Current_Player_HS[0]), Current_Player_HS[1])
                 numDiscards = 0
                 numDiscardActions = 0
                 inDiscardSection=False
             elif numDiscards==1 and numDiscardActions == 3:
-                infoset_str += Current_Player_HS
+                infoset_str += "H%d" % getBucket(float(Current_Player_HS[0]), Current_Player_HS[1])
                 numDiscards = 0
                 numDiscardActions = 0
                 inDiscardSection=False
             elif numDiscards==0 and numDiscardActions == 2:
-                infoset_str += Current_Player_HS
+                infoset_str += "H%d" % getBucket(float(Current_Player_HS[0]), Current_Player_HS[1])
                 numDiscards = 0
                 numDiscardActions = 0
                 inDiscardSection=False
@@ -442,6 +1093,63 @@ def convertHtoI(history, player):
     return infoset_str
 
 
+class LazyHandStrength(object):
+    """
+    A hand strength that is only computed the first time it's read, and then memoized.
+    History.simulateChance puts these in its chance packets, so that a strength is never computed unless convertHtoI
+    needs that player's bucket (the walk often folds first, and only one player's infoset is looked at per node).
+    Deep copies of a History share the same object, so the strength is computed at most once for the whole subtree.
+    """
+    def __init__(self, function, *args):
+        """
+        function, args: function(*args) returns the hand strength
+        """
+        self.Function = function
+        self.Args = args
+        self.Strength = None
+
+    def get(self):
+        if self.Strength == None:
+            self.Strength = self.Function(*self.Args)
+            self.Function, self.Args = None, None # let go of the arguments
+        return self.Strength
+
+    def __float__(self):
+        # rounded just like the "%.3f" in the history strings, so the buckets come out the same
+        return float(str(self))
+
+    def __str__(self):
+        return "%.3f" % self.get()
+
+    def __repr__(self):
+        return str(self)
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class ChancePacket(object):
+    """
+    A chance node's entry in History.History (i.e "FP:7s6c3s:H0:0.625:H1:0.586"), whose strength fields can be
+    LazyHandStrengths. split(":") returns the fields without computing anything, and str() gives the usual string.
+    """
+    def __init__(self, fields):
+        self.Fields = fields
+
+    def split(self, sep=":"):
+        assert sep == ":", "Error: chance packets can only be split on ':'"
+        return list(self.Fields)
+
+    def __str__(self):
+        return ":".join([str(f) for f in self.Fields])
+
+    def __repr__(self):
+        return repr(str(self))
+
+    def __deepcopy__(self, memo):
+        return self # never modified after it's created
+
+
 class History(object):
     """
     Gets passed down a game tree.
@@ -774,8 +1482,8 @@ class History(object):
             newHistory.Round = "B1" # betting round 1 is next
             newHistory.P1_HandStr = convertSyntax(newHistory.P1_Hand)
             newHistory.P2_HandStr = convertSyntax(newHistory.P2_Hand)
-            newHistory.History.append("H0:%s:%.3f:H1:%s:%.3f" % (newHistory.P1_HandStr, getHandStrength(newHistory.P1_HandStr, ""), \
-                                                            newHistory.P2_HandStr, getHandStrength(newHistory.P2_HandStr, "")))
+            newHistory.History.append(ChancePacket(["H0", newHistory.P1_HandStr, LazyHandStrength(getHandStrength, newHistory.P1_HandStr, ""), \
+                                                    "H1", newHistory.P2_HandStr, LazyHandStrength(getHandStrength, newHistory.P2_HandStr, "")]))
 
 
             # also, put in the bb and sb
@@ -797,29 +1505,34 @@ class History(object):
                 newHistory.Board = newHistory.Dealer.dealFlop()
                 newHistory.Round = "B1" # going to betting round next
                 newHistory.BoardStr = convertSyntax(newHistory.Board)
-                newHistory.History.append("FP:%s:H0:%.3f:H1:%.3f" % (newHistory.BoardStr, getHandStrength(newHistory.P1_HandStr, ""), getHandStrength(newHistory.P2_HandStr, "")))
+                # each player's strength is only sampled (until its bucket is known) if their infoset needs it
+                newHistory.History.append(ChancePacket(["FP", newHistory.BoardStr, "H0", getLazyBucketStrength(newHistory.P1_HandStr, newHistory.BoardStr), \
+                                                        "H1", getLazyBucketStrength(newHistory.P2_HandStr, newHistory.BoardStr)]))
 
             # TODO: also decide whether to discard, and do that
-            P1_shouldDiscard, P1_discardIndex, P1_swapEV, P1_originalEV = determineBestDiscardFast(self.P1_Hand, self.Board, min_improvement=0.02, iters=100)
-            P2_shouldDiscard, P2_discardIndex, P2_swapEV, P2_originalEV = determineBestDiscardFast(self.P2_Hand, self.Board, min_improvement=0.02, iters=100)
+            P1_shouldDiscard, P1_discardIndex, P1_swapEV, P1_originalEV = determineBestDiscardFromTable(self.P1_Hand, newHistory.Board)
+            P2_shouldDiscard, P2_discardIndex, P2_swapEV, P2_originalEV = determineBestDiscardFromTable(self.P2_Hand, newHistory.Board)
 
             # if its best to discard for either player, simulate that chance event
+            # the discarded cards stay dead for the new strengths, like in the live bot (see updateHandDiscard)
             if P1_shouldDiscard:
+                P1_dead = convertSyntax(newHistory.P1_Hand[P1_discardIndex])
                 newHistory.P1_Hand[P1_discardIndex] = newHistory.Dealer.dealCard()
                 newHistory.P1_HandStr = convertSyntax(newHistory.P1_Hand)
             if P2_shouldDiscard:
+                P2_dead = convertSyntax(newHistory.P2_Hand[P2_discardIndex])
                 newHistory.P2_Hand[P2_discardIndex] = newHistory.Dealer.dealCard()
                 newHistory.P2_HandStr = convertSyntax(newHistory.P2_Hand)
 
-            # append whether or not the player / opponent discarded
+            # append whether or not the player / opponent discarded, with the new (lazy) strength of whoever did
             if P1_shouldDiscard:
                 newHistory.History.append("0:D")
-                newHistory.History.append("H0:%s:%.3f" % (newHistory.P1_HandStr, getHandStrength(newHistory.P1_HandStr, newHistory.BoardStr)))
+                newHistory.History.append(ChancePacket(["H0", newHistory.P1_HandStr, getLazyBucketStrength(newHistory.P1_HandStr, newHistory.BoardStr, P1_dead)]))
             else: newHistory.History.append("0:CK")
 
             if P2_shouldDiscard:
                 newHistory.History.append("1:D")
-                newHistory.History.append("H1:%s:%.3f" % (newHistory.P2_HandStr, getHandStrength(newHistory.P2_HandStr, newHistory.BoardStr)))
+                newHistory.History.append(ChancePacket(["H1", newHistory.P2_HandStr, getLazyBucketStrength(newHistory.P2_HandStr, newHistory.BoardStr, P2_dead)]))
             else: newHistory.History.append("1:CK")
 
 
@@ -829,37 +1542,44 @@ class History(object):
                 newHistory.Board.append(newHistory.Dealer.dealCard())
                 newHistory.Round = "B1" # betting round next
                 newHistory.BoardStr = convertSyntax(newHistory.Board)
-                newHistory.History.append("TN:%s:H0:%.3f:H1:%.3f" % (newHistory.BoardStr, getHandStrength(newHistory.P1_HandStr, ""), getHandStrength(newHistory.P2_HandStr, "")))
+                # each player's strength is only sampled (until its bucket is known) if their infoset needs it
+                newHistory.History.append(ChancePacket(["TN", newHistory.BoardStr, "H0", getLazyBucketStrength(newHistory.P1_HandStr, newHistory.BoardStr), \
+                                                        "H1", getLazyBucketStrength(newHistory.P2_HandStr, newHistory.BoardStr)]))
 
             
             # TODO: also decide whether to discard, and do that
-            P1_shouldDiscard, P1_discardIndex, P1_swapEV, P1_originalEV = determineBestDiscardFast(self.P1_Hand, self.Board, min_improvement=0.02, iters=100)
-            P2_shouldDiscard, P2_discardIndex, P2_swapEV, P2_originalEV = determineBestDiscardFast(self.P2_Hand, self.Board, min_improvement=0.02, iters=100)
+            P1_shouldDiscard, P1_discardIndex, P1_swapEV, P1_originalEV = determineBestDiscardFromTable(self.P1_Hand, newHistory.Board)
+            P2_shouldDiscard, P2_discardIndex, P2_swapEV, P2_originalEV = determineBestDiscardFromTable(self.P2_Hand, newHistory.Board)
 
             # if its best to discard for either player, simulate that chance event
+            # the discarded cards stay dead for the new strengths, like in the live bot (see updateHandDiscard)
             if P1_shouldDiscard:
+                P1_dead = convertSyntax(newHistory.P1_Hand[P1_discardIndex])
                 newHistory.P1_Hand[P1_discardIndex] = newHistory.Dealer.dealCard()
                 newHistory.P1_HandStr = convertSyntax(newHistory.P1_Hand)
             if P2_shouldDiscard:
+                P2_dead = convertSyntax(newHistory.P2_Hand[P2_discardIndex])
                 newHistory.P2_Hand[P2_discardIndex] = newHistory.Dealer.dealCard()
                 newHistory.P2_HandStr = convertSyntax(newHistory.P2_Hand)
 
-            # append whether or not the player / opponent discarded
+            # append whether or not the player / opponent discarded, with the new (lazy) strength of whoever did
             if P1_shouldDiscard:
                 newHistory.History.append("0:D")
-                newHistory.History.append("H0:%s:%.3f" % (newHistory.P1_HandStr, getHandStrength(newHistory.P1_HandStr, newHistory.BoardStr)))
+                newHistory.History.append(ChancePacket(["H0", newHistory.P1_HandStr, getLazyBucketStrength(newHistory.P1_HandStr, newHistory.BoardStr, P1_dead)]))
             else: newHistory.History.append("0:CK")
 
             if P2_shouldDiscard:
                 newHistory.History.append("1:D")
-                newHistory.History.append("H1:%s:%.3f" % (newHistory.P2_HandStr, getHandStrength(newHistory.P2_HandStr, newHistory.BoardStr)))
+                newHistory.History.append(ChancePacket(["H1", newHistory.P2_HandStr, getLazyBucketStrength(newHistory.P2_HandStr, newHistory.BoardStr, P2_dead)]))
             else: newHistory.History.append("1:CK")
 
         elif self.Street == 3: # river, add a card
             newHistory.Board.append(newHistory.Dealer.dealCard())
             newHistory.Round = "B1" # betting round 1 is next
             newHistory.BoardStr = convertSyntax(newHistory.Board)
-            newHistory.History.append("RV:%s:H0:%.3f:H1:%.3f" % (newHistory.BoardStr, getHandStrength(newHistory.P1_HandStr, ""), getHandStrength(newHistory.P2_HandStr, "")))
+            # river strengths are exact, but still only computed for the players whose infosets need them
+            newHistory.History.append(ChancePacket(["RV", newHistory.BoardStr, "H0", LazyHandStrength(getHandStrength, newHistory.P1_HandStr, newHistory.BoardStr), \
+                                                    "H1", LazyHandStrength(getHandStrength, newHistory.P2_HandStr, newHistory.BoardStr)]))
 
         newHistory.NodeType = 1 # an action node always follows a chance node
         return newHistory
@@ -977,11 +1697,17 @@ class LightweightHistory(object):
         new_card: the Card (object) to replace the card at hand_index
         Also determines the updated hand's strength, and adds the appropriate item to the History list.
         """
+        discarded = self.P1_Hand[hand_index]
         self.P1_Hand[hand_index] = new_card
         self.P1_HandStr = convertSyntax(self.P1_Hand)
         #self.History.append("0:D")
         #self.History.append("0:D:%d" % hand_index)
-        self.History.append("H0:%s:%.3f" % (self.P1_HandStr, getHandStrength(self.P1_HandStr, self.BoardStr))) 
+        # our discarded card is dead on both streets, like in the training discard packets (see History.simulateChance)
+        if len(self.Board)==4: # turn, reuse the TurnContext from updateBoard
+            strength = getTurnHandStrength(cardsToIndices(self.P1_Hand), cardsToIndices(self.Board), cardToIndex(discarded))
+        else:
+            strength = getHandStrengthBuckets([self.P1_HandStr], self.BoardStr, NUM_BUCKETS[len(self.Board)], dead=convertSyntax(discarded))[1][0]
+        self.History.append("H0:%s:%.3f" % (self.P1_HandStr, strength))
 
 
     def updateHand(self, hand):
@@ -1010,10 +1736,10 @@ class LightweightHistory(object):
         self.BoardStr = convertSyntax(self.Board)
 
         if len(self.Board)==3: # flop 
-            self.History.append("FP:%s:H0:%.3f:H1:0.0" % (self.BoardStr, getHandStrength(self.P1_HandStr, self.BoardStr)))
+            self.History.append("FP:%s:H0:%.3f:H1:0.0" % (self.BoardStr, getHandStrengthBuckets([self.P1_HandStr], self.BoardStr, NUM_BUCKETS[3])[1][0]))
 
         elif len(self.Board)==4: # turn
-            self.History.append("TN:%s:H0:%.3f:H1:0.0" % (self.BoardStr, getHandStrength(self.P1_HandStr, self.BoardStr)))
+            self.History.append("TN:%s:H0:%.3f:H1:0.0" % (self.BoardStr, getTurnHandStrength(cardsToIndices(self.P1_Hand), cardsToIndices(self.Board))))
 
         elif len(self.Board)==5: # river
             self.History.append("RV:%s:H0:%.3f:H1:0.0" % (self.BoardStr, getHandStrength(self.P1_HandStr, self.BoardStr)))
@@ -0,0 +1,318 @@
+#!/usr/bin/env
+
+"""
+Offline tables of discard-aware equity and discard decisions for every canonical flop and turn board.
+
+The discard-aware equity of a holding is what it's worth when its owner plays the coming discard round well:
+the best of keeping it, or discarding either card for a random replacement (the average over replacements).
+    turn: exact. Every (replacement, river card, opponent holding) is enumerated with the board's TurnContext,
+          and the discarded card is dead.
+    flop: exact. Every (replacement, turn and river, opponent holding) is enumerated, one final board at a time with
+          BoardContext.getDeadCardEquities, and the discarded card is dead, like in board_context.getFlopSwapEquities
+          (what determineBestDiscardFull uses when a board isn't in the table). The turn discard round after it is
+          not looked ahead to.
+
+The discard policy of a holding is the decision determineBestDiscardFast approximates, from the same EVs: discard
+the card whose swap has the best EV if that beats keeping the hand by DISCARD_POLICY_MIN_IMPROVEMENT, and keep
+the hand otherwise. It's stored with both EVs.
+
+A table has one row per canonical board (boards canonicalized on their own, see isomorphism.py) with an entry for
+each of the 1326 holdings: a float16 equity (NaN if the holding uses a board card), or a 5 byte POLICY_DTYPE
+decision. So the flop tables are 4.6MB and 12MB, and the turn tables 44MB and 109MB. Looking up a hand
+canonicalizes the board and relabels the hand with the same suit permutation.
+
+Tables are built with buildDiscardTable() and buildDiscardPolicyTable() on a process pool. Each finished row is marked in a .done file, so an
+interrupted build picks up where it stopped. Loaded tables are memory-mapped. When a board is missing (no table, or
+the build isn't finished yet), getDiscardAwareEquity computes just the hand it was asked about, and keeps it in a
+small cache.
+
+Cards are ints 0-51 (see isomorphism.py).
+"""
+
+import os
+import numpy as np
+from itertools import combinations
+from lru import LRUCache
+from multiprocessing import Pool
+from board_context import BoardContext, TurnContext, getFlopSwapEquities
+from equity_matrix import HOLDINGS, NUM_HOLDINGS, HOLDING_INDEX, HOLDING_USES_CARD
+from isomorphism import canonicalize, applySuitPermutation
+
+# DEFINE THINGS #
+TABLE_DIR = os.path.dirname(os.path.abspath(__file__))
+DISCARD_TABLE_FILES = {3: os.path.join(TABLE_DIR, "discard_table_flop.npy"), 4: os.path.join(TABLE_DIR, "discard_table_turn.npy")}
+DISCARD_POLICY_FILES = {3: os.path.join(TABLE_DIR, "discard_policy_flop.npy"), 4: os.path.join(TABLE_DIR, "discard_policy_turn.npy")}
+
+# discard: -1 to keep the holding, otherwise the position (0 or 1) in HOLDINGS[h] of the card to discard
+POLICY_DTYPE = np.dtype([('discard', 'i1'), ('swap_ev', '<f2'), ('original_ev', '<f2')])
+DISCARD_POLICY_MIN_IMPROVEMENT = 0.02
+
+# loaded tables, keyed by (kind, number of board cards) where kind is "equity" or "policy": (values, done, board row index)
+DISCARD_TABLES = {}
+
+# discard-aware equities computed live for boards the equity table doesn't have yet, keyed by (canonical hand, canonical board)
+LIVE_EQUITIES = LRUCache(4096)
+# END DEFINITIONS #
+
+
+def getCanonicalBoards(num_cards):
+    """
+    Gets every canonical board with num_cards cards (1755 flops, 16432 turns), as an int8 array in a fixed order.
+    """
+    boards = set(tuple(canonicalize([], list(board))[1]) for board in combinations(range(52), num_cards))
+    return np.array(sorted(boards), dtype=np.int8)
+
+
+def computeDiscardEVs(board):
+    """
+    Computes the EV of keeping every holding on a flop or turn board, and of discarding either of its cards
+    (see the module docstring).
+    board: a list of 3 or 4 card ints
+    Returns: (keepEVs, swapEVs), float arrays of shape (1326,) and (1326, 2) indexed like equity_matrix.HOLDINGS, where
+        swapEVs[h][i] is the EV of discarding HOLDINGS[h][i]. Both are NaN where a holding uses a board card.
+    """
+    assert len(board) == 3 or len(board) == 4, "Error: discard EVs need a flop or turn board"
+    board = list(board)
+    valid = ~HOLDING_USES_CARD[:, board].any(axis=1)
+    holdings = HOLDINGS[valid]
+    deck = np.setdiff1d(np.arange(52), board)
+
+    if len(board) == 4:
+        # swapEquities[h][i][j] = equity after discarding card i of holding h and drawing the j'th replacement
+        turnContext = TurnContext(board)
+        notInHolding = deck[None, :] != holdings[:, 0:1]
+        notInHolding &= deck[None, :] != holdings[:, 1:2]
+        replacements = np.tile(deck, (len(holdings), 1))[notInHolding].reshape(len(holdings), 1, -1)
+        replacements = np.repeat(replacements, 2, axis=1) # (H, 2, 46)
+        kept = np.repeat(holdings[:, ::-1, None], replacements.shape[2], axis=2)
+        discarded = np.repeat(holdings[:, :, None], replacements.shape[2], axis=2)
+
+        swapEquities = turnContext.getEquities(np.stack([replacements.ravel(), kept.ravel()], axis=1), discarded.ravel())
+        validSwapEVs = swapEquities.reshape(replacements.shape).mean(axis=2)
+        validKeepEVs = turnContext.getEquities(holdings)
+    else:
+        # on each final board, swapSums[k][d] += the equity of every (replacement, k) with d dead, summed over replacements
+        keepSums = np.zeros((52, 52))
+        swapSums = np.zeros((52, 52))
+        counts = np.zeros((52, 52))
+        for runout in combinations(deck, 2):
+            context = BoardContext(board + list(runout))
+            remaining = context.Remaining
+            keepSums[context.Holdings[:, 0], context.Holdings[:, 1]] += context.getEquities()
+
+            # gathered[r][k][d] = equity of (remaining[r], remaining[k]) with remaining[d] dead, NaN if any of them match
+            deadEquities = np.vstack([context.getDeadCardEquities(), np.nan * np.ones(len(remaining))])
+            gathered = deadEquities[context.HoldingIndex[remaining[:, None], remaining[None, :]]]
+            swapSums[remaining[:, None], remaining[None, :]] += np.nansum(gathered, axis=0)
+            counts[remaining[:, None], remaining[None, :]] += len(remaining) - 2
+
+        # each holding is on every runout that doesn't use its cards
+        numRunouts = (len(deck) - 2) * (len(deck) - 3) / 2.0
+        validKeepEVs = keepSums[holdings[:, 0], holdings[:, 1]] / numRunouts
+        validSwapEVs = np.stack([swapSums[holdings[:, 1], holdings[:, 0]] / counts[holdings[:, 1], holdings[:, 0]],
+                                 swapSums[holdings[:, 0], holdings[:, 1]] / counts[holdings[:, 0], holdings[:, 1]]], axis=1)
+
+    keepEVs = np.empty(NUM_HOLDINGS)
+    keepEVs.fill(np.nan)
+    keepEVs[valid] = validKeepEVs
+    swapEVs = np.empty((NUM_HOLDINGS, 2))
+    swapEVs.fill(np.nan)
+    swapEVs[valid] = validSwapEVs
+    return (keepEVs, swapEVs)
+
+
+def computeDiscardAwareEquities(board):
+    """
+    Computes the discard-aware equity (see the module docstring) of every holding on a flop or turn board.
+    board: a list of 3 or 4 card ints
+    Returns: a float array of shape (1326,) indexed like equity_matrix.HOLDINGS, NaN where a holding uses a board card
+    """
+    keepEVs, swapEVs = computeDiscardEVs(board)
+    return np.maximum(keepEVs, swapEVs.max(axis=1))
+
+
+def computeHandDiscardAwareEquity(hand, board):
+    """
+    Computes the discard-aware equity of a single hand (a list of 2 card ints) on a flop or turn board (a list of 3 or
+    4 card ints). Same as the hand's entry in computeDiscardAwareEquities(board), without the rest of the board.
+    """
+    assert len(board) == 3 or len(board) == 4, "Error: discard-aware equity needs a flop or turn board"
+    if len(board) == 4:
+        turnContext = TurnContext(board)
+        keepEV = turnContext.getEquity(hand)
+        swapEquities = turnContext.getSwapEquities(hand)[1]
+    else:
+        replacements, swapEquities, keepEV = getFlopSwapEquities(board, hand)
+    return max(keepEV, swapEquities.mean(axis=1).max())
+
+
+def computeDiscardPolicy(board, min_improvement=DISCARD_POLICY_MIN_IMPROVEMENT):
+    """
+    Computes the discard decision (see the module docstring) of every holding on a flop or turn board.
+    board: a list of 3 or 4 card ints
+    Returns: a POLICY_DTYPE array of shape (1326,) indexed like equity_matrix.HOLDINGS (holdings that use a board card
+        have NaN EVs)
+    """
+    keepEVs, swapEVs = computeDiscardEVs(board)
+    valid = ~np.isnan(keepEVs)
+    bestSwap = np.zeros(NUM_HOLDINGS, dtype=np.int64)
+    bestSwap[valid] = np.argmax(swapEVs[valid], axis=1)
+    bestSwapEVs = swapEVs[np.arange(NUM_HOLDINGS), bestSwap]
+    shouldDiscard = np.zeros(NUM_HOLDINGS, dtype=bool)
+    shouldDiscard[valid] = bestSwapEVs[valid] > keepEVs[valid] + min_improvement
+
+    policy = np.zeros(NUM_HOLDINGS, dtype=POLICY_DTYPE)
+    policy['discard'] = np.where(shouldDiscard, bestSwap, -1)
+    policy['swap_ev'] = bestSwapEVs
+    policy['original_ev'] = keepEVs
+    return policy
+
+
+# how each kind of table computes a board's row, and the type of its entries
+TABLE_KINDS = {"equity": (computeDiscardAwareEquities, np.float16), "policy": (computeDiscardPolicy, POLICY_DTYPE)}
+
+
+def _tableFilenames(filename):
+    base = filename[0:-4] if filename.endswith(".npy") else filename
+    return (filename, base + ".boards.npy", base + ".done.npy")
+
+
+def _computeRow(args):
+    """
+    Worker for _buildTable (module level so that it can be pickled).
+    """
+    kind, index, board = args
+    computeRow, dtype = TABLE_KINDS[kind]
+    return (index, computeRow(list(board)).astype(dtype))
+
+
+def _buildTable(kind, num_cards, filename, processes, flush_every):
+    """
+    Builds (or finishes building) a table of the given kind, see buildDiscardTable().
+    """
+    assert num_cards in DISCARD_TABLE_FILES, "Error: discard tables are only for flop (3) and turn (4) boards"
+    valuesFile, boardsFile, doneFile = _tableFilenames(filename)
+
+    if os.path.isfile(boardsFile):
+        boards = np.load(boardsFile)
+        values = np.load(valuesFile, mmap_mode='r+')
+        done = np.load(doneFile, mmap_mode='r+')
+    else:
+        boards = getCanonicalBoards(num_cards)
+        np.save(boardsFile, boards)
+        values = np.lib.format.open_memmap(valuesFile, mode='w+', dtype=TABLE_KINDS[kind][1], shape=(len(boards), NUM_HOLDINGS))
+        done = np.lib.format.open_memmap(doneFile, mode='w+', dtype=np.uint8, shape=(len(boards),))
+
+    todo = [(kind, i, boards[i]) for i in np.nonzero(done == 0)[0]]
+    print "Discard table %s: %d/%d boards left" % (valuesFile, len(todo), len(boards))
+
+    pool = Pool(processes)
+    try:
+        for count, (index, row) in enumerate(pool.imap_unordered(_computeRow, todo), 1):
+            values[index] = row
+            done[index] = 1
+            if count % flush_every == 0 or count == len(todo):
+                # flush the values before the done flags, so a crash never marks a row that wasn't written
+                values.flush()
+                done.flush()
+                print "Finished %d/%d boards" % (count, len(todo))
+    finally:
+        pool.terminate()
+        values.flush()
+        done.flush()
+
+
+def buildDiscardTable(num_cards, filename=None, processes=None, flush_every=50):
+    """
+    Builds (or finishes building) the discard-aware equity table for every canonical board with num_cards cards.
+    num_cards: 3 for the flop table, 4 for the turn table
+    filename: the table's .npy file (default DISCARD_TABLE_FILES[num_cards]). Its .boards.npy and .done.npy files
+        are kept next to it, and rows already marked done are skipped.
+    processes: the number of worker processes (default: one per core)
+    flush_every: how many rows to finish between writes to disk
+    """
+    _buildTable("equity", num_cards, filename or DISCARD_TABLE_FILES[num_cards], processes, flush_every)
+
+
+def buildDiscardPolicyTable(num_cards, filename=None, processes=None, flush_every=50):
+    """
+    Builds (or finishes building) the discard policy table for every canonical board with num_cards cards.
+    Same arguments as buildDiscardTable(), but filename defaults to DISCARD_POLICY_FILES[num_cards].
+    """
+    _buildTable("policy", num_cards, filename or DISCARD_POLICY_FILES[num_cards], processes, flush_every)
+
+
+def _loadTable(kind, filename):
+    valuesFile, boardsFile, doneFile = _tableFilenames(filename)
+    if not os.path.isfile(boardsFile):
+        return False
+
+    boards = np.load(boardsFile)
+    rowIndex = dict([(tuple(board), i) for i, board in enumerate(boards.tolist())])
+    DISCARD_TABLES[(kind, boards.shape[1])] = (np.load(valuesFile, mmap_mode='r'), np.load(doneFile, mmap_mode='r'), rowIndex)
+    return True
+
+
+def loadDiscardTable(num_cards, filename=None):
+    """
+    Memory-maps a discard-aware equity table for getDiscardAwareEquity (an unfinished table is fine too).
+    Returns False if the table doesn't exist.
+    """
+    return _loadTable("equity", filename or DISCARD_TABLE_FILES[num_cards])
+
+
+def loadDiscardPolicyTable(num_cards, filename=None):
+    """
+    Memory-maps a discard policy table for getDiscardPolicy (an unfinished table is fine too).
+    Returns False if the table doesn't exist.
+    """
+    return _loadTable("policy", filename or DISCARD_POLICY_FILES[num_cards])
+
+
+def _getTableRow(kind, canonicalBoard):
+    """
+    Gets a canonical board's row from the loaded table of the given kind, or None if it isn't there (yet).
+    """
+    table = DISCARD_TABLES.get((kind, len(canonicalBoard)))
+    if table != None:
+        values, done, rowIndex = table
+        index = rowIndex[canonicalBoard]
+        if done[index]:
+            return values[index]
+    return None
+
+
+def getDiscardAwareEquity(hand, board):
+    """
+    Gets the discard-aware equity of a hand (a list of 2 card ints) on a flop or turn board (a list of 3 or 4 card ints),
+    from the loaded table if it has the board, or else computed live for just this hand (about a second on the flop).
+    """
+    canonicalHand, canonicalBoard, perm = canonicalize([], board)
+    row = _getTableRow("equity", tuple(canonicalBoard))
+    if row is not None:
+        permuted = applySuitPermutation(hand, perm)
+        return float(row[HOLDING_INDEX[permuted[0], permuted[1]]])
+
+    canonicalHand, canonicalBoard, perm = canonicalize(hand, board)
+    return LIVE_EQUITIES.getOrBuild((tuple(canonicalHand), tuple(canonicalBoard)),
+                                    lambda: computeHandDiscardAwareEquity(canonicalHand, canonicalBoard))
+
+
+def getDiscardPolicy(hand, board):
+    """
+    Looks up the discard decision of a hand (a list of 2 card ints) on a flop or turn board (a list of 3 or 4 card ints).
+    Returns: (shouldDiscard, discardIndex, swapEV, originalEV) like cfr.determineBestDiscardFast, where discardIndex
+        is the index in hand of the card to discard. Returns None if no loaded policy table has the board.
+    """
+    canonicalHand, canonicalBoard, perm = canonicalize([], board)
+    row = _getTableRow("policy", tuple(canonicalBoard))
+    if row is None:
+        return None
+
+    permuted = applySuitPermutation(hand, perm)
+    holding = HOLDING_INDEX[permuted[0], permuted[1]]
+    entry = row[holding]
+    if entry['discard'] < 0:
+        return (False, None, 0, float(entry['original_ev']))
+    discardIndex = permuted.index(HOLDINGS[holding][entry['discard']])
+    return (True, discardIndex, float(entry['swap_ev']), float(entry['original_ev']))
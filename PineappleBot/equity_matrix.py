@@ -0,0 +1,123 @@
+#!/usr/bin/env
+
+"""
+Dense hand-vs-hand equity matrices for turn and river boards.
+
+EquityMatrix[i][j] is the equity of holding i against holding j (wins + 0.5*ties), where holdings are indexed
+0-1325 in the order of combinations(range(52), 2). Pairs that share a card, or use a board card, are NaN.
+River matrices are exact showdowns, and turn matrices average the showdowns over every river card.
+
+Matrices are computed for the canonical (suit isomorphic) board and then relabeled, so boards that only differ
+by suits share the work. Recently used matrices are kept in memory, and can also be saved to .npy files that are
+memory-mapped when they are loaded again.
+
+Cards are ints 0-51 (see isomorphism.py).
+"""
+
+import os
+import numpy as np
+from itertools import combinations
+from lru import LRUCache
+from board_context import BoardContext, TurnContext
+from isomorphism import canonicalize, indicesToString
+
+# DEFINE THINGS #
+HOLDINGS = np.array(list(combinations(range(52), 2)), dtype=np.int64) # (1326, 2)
+NUM_HOLDINGS = len(HOLDINGS)
+
+# HOLDING_INDEX[c1][c2] = index of holding (c1, c2) in HOLDINGS
+HOLDING_INDEX = np.zeros((52, 52), dtype=np.int64)
+HOLDING_INDEX[HOLDINGS[:, 0], HOLDINGS[:, 1]] = np.arange(NUM_HOLDINGS)
+HOLDING_INDEX[HOLDINGS[:, 1], HOLDINGS[:, 0]] = np.arange(NUM_HOLDINGS)
+
+# HOLDING_USES_CARD[i][c] is True if holding i contains card c
+HOLDING_USES_CARD = np.zeros((NUM_HOLDINGS, 52), dtype=bool)
+HOLDING_USES_CARD[np.arange(NUM_HOLDINGS)[:, None], HOLDINGS] = True
+
+# HOLDINGS_OVERLAP[i][j] is True if holdings i and j share a card
+HOLDINGS_OVERLAP = np.dot(HOLDING_USES_CARD.astype(np.int32), HOLDING_USES_CARD.T.astype(np.int32)) > 0
+
+# most recently used matrices, keyed by canonical board
+EQUITY_MATRICES = LRUCache(8)
+# END DEFINITIONS #
+
+
+def _showdownMatrix(context):
+    """
+    Gets the showdown matrix (1, 0.5 or 0, and NaN where a holding is blocked) of every holding pair on a river board.
+    context: the board's BoardContext
+    """
+    valid = ~HOLDING_USES_CARD[:, context.Board].any(axis=1)
+    ranks = np.zeros(NUM_HOLDINGS, dtype=np.int64)
+    ranks[valid] = context.Ranks[context.HoldingIndex[HOLDINGS[valid, 0], HOLDINGS[valid, 1]]]
+
+    showdowns = (ranks[:, None] > ranks[None, :]) + 0.5*(ranks[:, None] == ranks[None, :])
+    return showdowns.astype(np.float32), valid
+
+
+def computeEquityMatrix(board):
+    """
+    Computes the equity matrix of a 4 or 5 card board (a list of card ints) from scratch.
+    Returns: a float32 array of shape (1326, 1326)
+    """
+    assert len(board) == 4 or len(board) == 5, "Error: equity matrices need a turn or river board"
+
+    if len(board) == 5:
+        equities, valid = _showdownMatrix(BoardContext(board))
+        pairValid = valid[:, None] & valid[None, :]
+    else:
+        # average the river showdowns, counting only the river cards that neither holding uses
+        turnContext = TurnContext(board)
+        sums = np.zeros((NUM_HOLDINGS, NUM_HOLDINGS), dtype=np.float32)
+        counts = np.zeros((NUM_HOLDINGS, NUM_HOLDINGS), dtype=np.float32)
+        for context in turnContext.Contexts:
+            showdowns, valid = _showdownMatrix(context)
+            riverValid = (valid[:, None] & valid[None, :]).astype(np.float32)
+            sums += showdowns * riverValid
+            counts += riverValid
+
+        pairValid = counts > 0
+        equities = sums / np.maximum(counts, 1)
+
+    equities[~pairValid | HOLDINGS_OVERLAP] = np.nan
+    return equities
+
+
+def _matrixFilename(cache_dir, canonicalBoard):
+    return os.path.join(cache_dir, "equity_matrix_%s.npy" % indicesToString(canonicalBoard))
+
+
+def getEquityMatrix(board, cache_dir=None):
+    """
+    Gets the equity matrix of a 4 or 5 card board (a list of card ints).
+    The matrix is computed for the canonical board (or loaded from memory or cache_dir), then relabeled to board's suits.
+    cache_dir: optional directory of saved .npy matrices. Missing matrices are saved there, and saved ones are memory-mapped.
+    Returns: a float32 array of shape (1326, 1326), see the module docstring. Don't modify it.
+    """
+    canonicalHand, canonicalBoard, perm = canonicalize([], board)
+    key = tuple(canonicalBoard)
+
+    matrix = EQUITY_MATRICES.get(key)
+    if matrix is None:
+        filename = None if cache_dir == None else _matrixFilename(cache_dir, canonicalBoard)
+        if filename != None and os.path.isfile(filename):
+            matrix = np.load(filename, mmap_mode='r')
+        else:
+            matrix = computeEquityMatrix(canonicalBoard)
+            if filename != None:
+                np.save(filename, matrix)
+        EQUITY_MATRICES.put(key, matrix)
+
+    # holding i on board is holding canonicalIndex[i] on the canonical board
+    permuted = np.array([4*(c // 4) + perm[c % 4] for c in range(52)], dtype=np.int64)
+    canonicalIndex = HOLDING_INDEX[permuted[HOLDINGS[:, 0]], permuted[HOLDINGS[:, 1]]]
+    if (canonicalIndex == np.arange(NUM_HOLDINGS)).all():
+        return matrix
+    return matrix[np.ix_(canonicalIndex, canonicalIndex)]
+
+
+def getHoldingEquity(hand1, hand2, board, cache_dir=None):
+    """
+    Gets the equity of hand1 against hand2 (lists of 2 card ints) on a 4 or 5 card board.
+    """
+    return float(getEquityMatrix(board, cache_dir)[HOLDING_INDEX[hand1[0], hand1[1]], HOLDING_INDEX[hand2[0], hand2[1]]])
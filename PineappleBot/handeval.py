@@ -0,0 +1,182 @@
+#!/usr/bin/env
+
+"""
+Lookup-table based hand evaluator that ranks many 5, 6 or 7 card hands in one vectorized numpy pass.
+
+Cards are ints 0-51 (see isomorphism.py): index = 4*(rank-2) + (suit-1).
+
+A hand's rank is an int from 1 (7-5-4-3-2 offsuit) to 7462 (royal flush), so two hands can be compared directly.
+Non-flush hands only depend on how many cards of each rank there are, so they are looked up by a key built from
+the rank counts. Flushes only depend on the ranks present in the flush suit, so they are looked up by a 13 bit
+rank mask (one lookup per suit). The tables are built once at import.
+
+7 card hands use per-rank keys whose sums are unique for every 7 card rank multiset, which lets us index a flat
+table directly. 5 and 6 card hands fall back to a binary search over base-5 rank count keys.
+"""
+
+import numpy as np
+
+# hand categories, stored in the top bits of a hand's raw value
+HIGH_CARD, PAIR, TWO_PAIR, TRIPS, STRAIGHT, FLUSH, FULL_HOUSE, QUADS, STRAIGHT_FLUSH = range(9)
+
+# rank masks of every straight, from the ace-high straight down to the wheel (A2345)
+STRAIGHT_MASKS = [0x1F << low for low in range(8, -1, -1)] + [0x100F]
+STRAIGHT_HIGH_CARDS = range(12, 3, -1) + [3]
+
+# per-rank keys with a unique sum for every multiset of 7 ranks (at most 4 of each)
+SEVEN_CARD_RANK_KEYS = [0, 1, 5, 22, 98, 453, 2031, 8698, 22854, 83661, 262349, 636345, 1479181]
+
+
+def _rawValue(category, kickers):
+    """
+    Packs a hand category and up to 5 kicker ranks (0-12, most important first) into a single int.
+    """
+    value = category
+    for i in range(5):
+        value = (value << 4) | (kickers[i] if i < len(kickers) else 0)
+    return value
+
+
+def _straightHighCard(mask):
+    """
+    Returns the high card rank of the best straight in a 13 bit rank mask, or None if there isn't one.
+    """
+    for i in range(len(STRAIGHT_MASKS)):
+        if (mask & STRAIGHT_MASKS[i]) == STRAIGHT_MASKS[i]:
+            return STRAIGHT_HIGH_CARDS[i]
+    return None
+
+
+def _nonFlushRawValue(counts):
+    """
+    Gets the raw value of the best 5 card hand (ignoring flushes) given the number of cards of each rank.
+    """
+    ranksByCount = [[], [], [], [], []] # ranksByCount[n] = ranks we have exactly n of, high to low
+    for r in range(12, -1, -1):
+        ranksByCount[counts[r]].append(r)
+    present = [r for r in range(12, -1, -1) if counts[r] > 0]
+
+    if ranksByCount[4]:
+        quad = ranksByCount[4][0]
+        return _rawValue(QUADS, [quad] + [r for r in present if r != quad][0:1])
+
+    if ranksByCount[3]:
+        trip = ranksByCount[3][0]
+        pairs = sorted(ranksByCount[3][1:] + ranksByCount[2], reverse=True)
+        if pairs:
+            return _rawValue(FULL_HOUSE, [trip, pairs[0]])
+
+    mask = 0
+    for r in present:
+        mask |= (1 << r)
+    straightHigh = _straightHighCard(mask)
+    if straightHigh != None:
+        return _rawValue(STRAIGHT, [straightHigh])
+
+    if ranksByCount[3]:
+        trip = ranksByCount[3][0]
+        return _rawValue(TRIPS, [trip] + [r for r in present if r != trip][0:2])
+
+    if len(ranksByCount[2]) >= 2:
+        high, low = ranksByCount[2][0], ranksByCount[2][1]
+        return _rawValue(TWO_PAIR, [high, low] + [r for r in present if r != high and r != low][0:1])
+
+    if ranksByCount[2]:
+        pair = ranksByCount[2][0]
+        return _rawValue(PAIR, [pair] + [r for r in present if r != pair][0:3])
+
+    return _rawValue(HIGH_CARD, present[0:5])
+
+
+def _flushRawValue(mask):
+    """
+    Gets the raw value of the best flush that can be made from a 13 bit mask of suited ranks (at least 5 bits).
+    """
+    straightHigh = _straightHighCard(mask)
+    if straightHigh != None:
+        return _rawValue(STRAIGHT_FLUSH, [straightHigh])
+    return _rawValue(FLUSH, [r for r in range(12, -1, -1) if mask & (1 << r)][0:5])
+
+
+def _rankCountMultisets(num_cards, max_rank=12):
+    """
+    Generates every list of 13 rank counts (each 0-4) that adds up to num_cards.
+    """
+    if max_rank < 0:
+        if num_cards == 0:
+            yield [0] * 13
+        return
+    for n in range(min(4, num_cards), -1, -1):
+        for counts in _rankCountMultisets(num_cards - n, max_rank - 1):
+            counts[max_rank] = n
+            yield counts
+
+
+def _buildTables():
+    """
+    Builds the sorted non-flush key table, the direct 7 card non-flush table and the flush mask table,
+    with all values mapped to dense ranks 1-7462.
+    """
+    nonFlushKeys, nonFlushRaw, sevenCardKeys = [], [], []
+    for numCards in [5, 6, 7]:
+        for counts in _rankCountMultisets(numCards):
+            nonFlushKeys.append(sum([counts[r] * (5 ** r) for r in range(13)]))
+            nonFlushRaw.append(_nonFlushRawValue(counts))
+            if numCards == 7:
+                sevenCardKeys.append(sum([counts[r] * SEVEN_CARD_RANK_KEYS[r] for r in range(13)]))
+
+    flushRaw = [0] * 8192
+    for mask in range(8192):
+        if bin(mask).count("1") >= 5:
+            flushRaw[mask] = _flushRawValue(mask)
+
+    # map raw values to dense ranks, keeping 0 as 'no flush'
+    distinct = np.unique(np.array(nonFlushRaw + [v for v in flushRaw if v > 0], dtype=np.int64))
+    denseRank = lambda raw: np.searchsorted(distinct, np.array(raw, dtype=np.int64)) + 1
+
+    order = np.argsort(np.array(nonFlushKeys, dtype=np.int64))
+    keys = np.array(nonFlushKeys, dtype=np.int64)[order]
+    nonFlushRanks = denseRank(nonFlushRaw)[order].astype(np.int32)
+
+    sevenCardRanks = np.zeros(max(sevenCardKeys) + 1, dtype=np.int16)
+    sevenCardRanks[np.array(sevenCardKeys)] = denseRank(nonFlushRaw[-len(sevenCardKeys):])
+
+    flushRanks = np.where(np.array(flushRaw) > 0, denseRank(flushRaw), 0).astype(np.int32)
+    return keys, nonFlushRanks, sevenCardRanks, flushRanks
+
+
+# DEFINE THINGS #
+NUM_HAND_RANKS = 7462
+NONFLUSH_KEYS, NONFLUSH_RANKS, SEVEN_CARD_RANKS, FLUSH_RANKS = _buildTables()
+
+# per-card contributions to the rank count keys, and to the 4 packed 16 bit suit masks
+CARD_RANK_KEY = np.array([5 ** (c // 4) for c in range(52)], dtype=np.int64)
+CARD_SEVEN_CARD_KEY = np.array([SEVEN_CARD_RANK_KEYS[c // 4] for c in range(52)], dtype=np.int32)
+CARD_SUIT_MASK = np.array([(1 << (c // 4)) << (16 * (c % 4)) for c in range(52)], dtype=np.int64)
+# END DEFINITIONS #
+
+
+def evaluate(cards):
+    """
+    Ranks a batch of hands.
+    cards: an int array of shape (N, k) with 5 <= k <= 7, each row holding distinct card ints
+    Returns: an int32 array of shape (N,), where a higher rank is a better hand and equal ranks tie
+    """
+    cards = np.asarray(cards)
+    if cards.shape[-1] == 7:
+        ranks = SEVEN_CARD_RANKS[CARD_SEVEN_CARD_KEY[cards].sum(axis=-1)].astype(np.int32)
+    else:
+        ranks = NONFLUSH_RANKS[np.searchsorted(NONFLUSH_KEYS, CARD_RANK_KEY[cards].sum(axis=-1))]
+
+    # a rank mask for each suit; only suits with 5+ cards have a nonzero flush rank
+    suitMasks = CARD_SUIT_MASK[cards].sum(axis=-1)
+    for suit in range(4):
+        ranks = np.maximum(ranks, FLUSH_RANKS[(suitMasks >> (16 * suit)) & 0x1FFF])
+    return ranks
+
+
+def evaluateOne(cards):
+    """
+    Ranks a single hand given as a list of 5-7 card ints.
+    """
+    return int(evaluate([cards])[0])
@@ -0,0 +1,154 @@
+#!/usr/bin/env
+
+"""
+Suit isomorphism for (hand, board) pairs.
+
+Two states that only differ by a relabeling of suits (i.e Kh Qh | 7s 6s 3s and Kd Qd | 7c 6c 3c)
+are strategically identical, so hand strengths, discard decisions and precomputed tables only need
+to be stored once for each canonical representative.
+
+Cards are represented as ints 0-51, in the same order as cfr.FULL_DECK:
+    index = 4*(rank-2) + (suit-1)
+where rank is 2-14 (2-A) and suit is 1-4 (s,h,d,c). Everything is table driven, so canonicalize()
+is cheap enough to call at every chance node.
+"""
+
+RANK_CHARS = "23456789TJQKA"
+SUIT_CHARS = "shdc"
+
+# DEFINE THINGS #
+CARD_STRINGS = [r+s for r in RANK_CHARS for s in SUIT_CHARS] # index -> "Ah"
+CARD_INDICES = dict([(CARD_STRINGS[i], i) for i in range(52)]) # "Ah" -> index
+CARD_SUIT = [i % 4 for i in range(52)] # index -> suit (0-3)
+CARD_RANK_BIT = [1 << (i // 4) for i in range(52)] # index -> 13 bit rank mask
+
+# PERMUTED_CARD[perm_id][card] is the card after its suit is relabeled by perm
+SUIT_PERMUTATIONS = []
+PERMUTATION_IDS = {}
+for a in range(4):
+    for b in range(4):
+        for c in range(4):
+            for d in range(4):
+                if len(set([a, b, c, d])) == 4:
+                    PERMUTATION_IDS[(a, b, c, d)] = len(SUIT_PERMUTATIONS)
+                    SUIT_PERMUTATIONS.append((a, b, c, d))
+PERMUTED_CARD = [[4*(i // 4) + perm[i % 4] for i in range(52)] for perm in SUIT_PERMUTATIONS]
+# END DEFINITIONS #
+
+
+def cardToIndex(card):
+    """
+    Converts a pokereval Card object into an int 0-51.
+    """
+    return 4*(card.rank-2) + (card.suit-1)
+
+
+def cardsToIndices(cards):
+    """
+    Converts a list of Card objects or a pbots_calc card string (i.e "AhKd") into a list of ints.
+    """
+    if type(cards) == str:
+        return [CARD_INDICES[cards[i:i+2]] for i in range(0, len(cards), 2)]
+    else:
+        return [cardToIndex(c) for c in cards]
+
+
+def indicesToString(cards):
+    """
+    Converts a list of card ints into a pbots_calc card string (i.e [50, 45] -> "AdKh")
+    """
+    return "".join([CARD_STRINGS[c] for c in cards])
+
+
+def canonicalize(hand, board):
+    """
+    Maps a (hand, board) pair to its canonical representative.
+    hand: a list of card ints (0 or 2 cards)
+    board: a list of card ints (0, 3, 4 or 5 cards)
+
+    Suits are ordered by (rank mask in hand, rank mask on board) and relabeled s,h,d,c in that order,
+    so every member of an isomorphism class maps to the same output. Hand and board come back sorted high to low.
+
+    Returns: (canonical_hand, canonical_board, perm) where perm[old_suit] = new_suit.
+    """
+    handMasks = [0, 0, 0, 0]
+    boardMasks = [0, 0, 0, 0]
+    for c in hand:
+        handMasks[CARD_SUIT[c]] |= CARD_RANK_BIT[c]
+    for c in board:
+        boardMasks[CARD_SUIT[c]] |= CARD_RANK_BIT[c]
+
+    # suits with identical signatures are interchangeable, so ties don't matter
+    signatures = [((handMasks[s] << 13) | boardMasks[s], s) for s in range(4)]
+    signatures.sort(reverse=True)
+
+    perm = [0, 0, 0, 0]
+    for newSuit in range(4):
+        perm[signatures[newSuit][1]] = newSuit
+    perm = tuple(perm)
+
+    permuted = PERMUTED_CARD[PERMUTATION_IDS[perm]]
+    canonicalHand = sorted([permuted[c] for c in hand], reverse=True)
+    canonicalBoard = sorted([permuted[c] for c in board], reverse=True)
+    return (canonicalHand, canonicalBoard, perm)
+
+
+def invertSuitPermutation(perm):
+    """
+    Returns the permutation that undoes perm.
+    """
+    inverse = [0, 0, 0, 0]
+    for oldSuit in range(4):
+        inverse[perm[oldSuit]] = oldSuit
+    return tuple(inverse)
+
+
+def applySuitPermutation(cards, perm):
+    """
+    Relabels the suits of a list of card ints according to perm (perm[old_suit] = new_suit).
+    """
+    permuted = PERMUTED_CARD[PERMUTATION_IDS[tuple(perm)]]
+    return [permuted[c] for c in cards]
+
+
+def uncanonicalize(cards, perm):
+    """
+    Maps cards from the canonical suit labeling back to the original one.
+    perm: the permutation returned by canonicalize()
+    """
+    return applySuitPermutation(cards, invertSuitPermutation(perm))
+
+
+def getCanonicalKey(handstr, boardstr):
+    """
+    Gets a string key for the canonical form of a hand and board in pbots_calc syntax.
+    i.e getCanonicalKey("KhQh", "7s6s3s") == getCanonicalKey("QdKd", "3c7c6c") == "KsQs|7h6h3h"
+    """
+    canonicalHand, canonicalBoard, perm = canonicalize(cardsToIndices(handstr), cardsToIndices(boardstr))
+    return "%s|%s" % (indicesToString(canonicalHand), indicesToString(canonicalBoard))
+
+
+def getPreflopClassIndex(hand):
+    """
+    Maps a 2 card hand (list of card ints) to one of the 169 preflop classes, as an index into a 13x13 grid:
+    pairs are 13*r+r, suited hands are 13*high+low, and offsuit hands are 13*low+high (ranks 0-12).
+    """
+    r1, r2 = hand[0] // 4, hand[1] // 4
+    high, low = max(r1, r2), min(r1, r2)
+    if CARD_SUIT[hand[0]] == CARD_SUIT[hand[1]]:
+        return 13*high + low
+    else:
+        return 13*low + high
+
+
+def getPreflopClassName(index):
+    """
+    Gets the name of a preflop class index, i.e "AA", "AKs" or "AKo".
+    """
+    r1, r2 = index // 13, index % 13
+    if r1 == r2:
+        return RANK_CHARS[r1]*2
+    elif r1 > r2:
+        return RANK_CHARS[r1] + RANK_CHARS[r2] + "s"
+    else:
+        return RANK_CHARS[r2] + RANK_CHARS[r1] + "o"
@@ -0,0 +1,62 @@
+#!/usr/bin/env
+
+"""
+A small least recently used cache, shared by the per-board caches (BoardContexts, TurnContexts, equity matrices),
+the live discard-aware equities and the hand strength cache.
+"""
+
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    A dict with at most max_size entries. Reading or writing an entry makes it the most recently used one, and adding
+    an entry to a full cache evicts the least recently used one.
+    """
+    def __init__(self, max_size):
+        self.MaxSize = max_size
+        self.Entries = OrderedDict()
+
+    def get(self, key):
+        """
+        Returns the value for key (and marks it as the most recently used), or None if it isn't cached.
+        """
+        value = self.Entries.pop(key, None)
+        if value is not None:
+            self.Entries[key] = value # re-insert so that this entry is the most recently used
+        return value
+
+    def put(self, key, value):
+        """
+        Adds (or replaces) an entry, evicting the least recently used entry if the cache is full.
+        """
+        if key in self.Entries:
+            self.Entries.pop(key)
+        elif len(self.Entries) >= self.MaxSize:
+            self.Entries.popitem(last=False)
+        self.Entries[key] = value
+
+    def getOrBuild(self, key, build):
+        """
+        Returns the value for key, calling build() to make (and cache) it if it isn't cached.
+        """
+        value = self.get(key)
+        if value is None:
+            value = build()
+            self.put(key, value)
+        return value
+
+    def items(self):
+        """
+        Returns every (key, value) pair, from least to most recently used.
+        """
+        return self.Entries.items()
+
+    def clear(self):
+        self.Entries.clear()
+
+    def __contains__(self, key):
+        return key in self.Entries
+
+    def __len__(self):
+        return len(self.Entries)
@@ -0,0 +1,119 @@
+#!/usr/bin/env
+
+"""
+A pure numpy equity backend with the same interface as pbots_calc.py (calc() and a Calculator class), built on the
+handeval lookup tables. It is used when libpbots_calc can't be loaded, or when it is simply faster on a machine.
+
+Queries use pbots_calc syntax, limited to what this project uses: hands are separated by ":", and each one is
+either 2 explicit cards (i.e "AhKd") or "xx" for a random hand. board and dead are card strings.
+Hand vs random hand on a complete board is exact (every opponent holding is enumerated), everything else is
+vectorized Monte Carlo.
+"""
+
+import numpy as np
+from handeval import evaluate
+from board_context import BoardContext
+from isomorphism import CARD_INDICES
+
+# this backend has no native dependencies
+AVAILABLE = True
+
+
+class Results:
+    """
+    The result of a calc() call, with the same fields as pbots_calc's Results (ev is a numpy array here).
+    """
+    def __init__(self, ev, hands, iters, MC_used):
+        self.size = len(ev)
+        self.MC_used = MC_used
+        self.iters = iters
+        self.ev = ev
+        self.hands = hands
+
+    def __str__(self):
+        return str(zip(self.hands, self.ev))
+
+
+def _parseCards(cardstr):
+    """
+    Parses a card string into a list of card ints, or returns None if it isn't valid.
+    """
+    if len(cardstr) % 2 != 0:
+        return None
+    cards = [CARD_INDICES.get(cardstr[i:i+2]) for i in range(0, len(cardstr), 2)]
+    return None if None in cards else cards
+
+
+def calc(hands, board, dead, iters):
+    """
+    Same arguments and return value as pbots_calc.calc(). Returns None if the input can't be parsed.
+    """
+    handStrs = hands.split(":")
+    players = [None if h == "xx" else _parseCards(h) for h in handStrs]
+    boardCards = _parseCards(board)
+    deadCards = _parseCards(dead)
+
+    known = [c for p in players if p != None for c in p] + (boardCards or []) + (deadCards or [])
+    valid = boardCards != None and deadCards != None and len(boardCards) <= 5 and len(players) >= 2 and \
+        all([p == None or len(p) == 2 for p in players]) and len(set(known)) == len(known)
+    if not valid:
+        print "error: could not parse input or something..."
+        return None
+
+    # a hand against a random hand on the river: exact
+    if len(boardCards) == 5 and len(players) == 2 and len(deadCards) == 0 and (players[0] == None) != (players[1] == None):
+        hero = 0 if players[0] != None else 1
+        equity = BoardContext(boardCards).getEquity(players[hero])
+        ev = np.array([equity, 1.0 - equity]) if hero == 0 else np.array([1.0 - equity, equity])
+        return Results(ev, handStrs, 990, 0)
+
+    # deal random hands and the rest of the board for every iteration, from the cards that are still in the deck
+    excluded = np.zeros((iters, 52), dtype=bool)
+    excluded[:, known] = True
+    keys = np.random.random_sample((iters, 52))
+    keys[excluded] = 2.0 # known cards sort after every card that can be dealt
+    numRandom = len([p for p in players if p == None])
+    dealt = np.argsort(keys, axis=1)[:, 0:2*numRandom + 5 - len(boardCards)]
+
+    fullBoards = np.concatenate([np.tile(np.array(boardCards, dtype=np.int64), (iters, 1)), dealt[:, 2*numRandom:]], axis=1)
+    ranks = np.empty((len(players), iters), dtype=np.int64)
+    nextRandom = 0
+    for i in range(len(players)):
+        if players[i] == None:
+            holeCards = dealt[:, 2*nextRandom:2*nextRandom+2]
+            nextRandom += 1
+        else:
+            holeCards = np.tile(np.array(players[i], dtype=np.int64), (iters, 1))
+        ranks[i] = evaluate(np.concatenate([holeCards, fullBoards], axis=1))
+
+    # split each pot between the players with the best hand
+    winners = (ranks == ranks.max(axis=0))
+    ev = (winners / winners.sum(axis=0).astype(np.float64)).mean(axis=1)
+    return Results(ev, handStrs, iters, 1)
+
+
+class Calculator:
+    """
+    Same interface as pbots_calc.Calculator. There are no native buffers to reuse, so this just calls calc().
+    """
+    def __init__(self, pool_size=1):
+        pass
+
+    def calc(self, hands, board, dead, iters):
+        return calc(hands, board, dead, iters)
+
+    def calc_many(self, queries):
+        """
+        Runs a list of (hands, board, dead, iters) queries, see pbots_calc.Calculator.calc_many().
+        """
+        width = max([q[0].count(":") + 1 for q in queries]) if queries else 1
+        evs = np.empty((len(queries), width))
+        evs.fill(np.nan)
+        for i in range(len(queries)):
+            result = self.calc(*queries[i])
+            if result != None:
+                evs[i, 0:result.size] = result.ev
+        return evs
+
+    def close(self):
+        pass
@@ -0,0 +1,78 @@
+#!/usr/bin/env
+
+"""
+Runs pbots_calc queries on a pool of threads.
+
+ctypes releases the GIL while pbots_calc is running, so plain threads give real parallel speedup
+on equity calculations without the overhead of multiprocessing. Each thread gets its own Calculator
+(and therefore its own result buffers), since a Calculator is not thread-safe.
+"""
+
+import threading
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+import numpy as np
+from pbots_calc import Calculator
+
+
+class EquityExecutor(object):
+    """
+    A thread pool for pbots_calc queries, sized to the number of cores by default.
+    Queries are (hands, board, dead, iters) tuples, the same arguments as pbots_calc.calc().
+    calculator_class: the Calculator class of the equity backend to use (see cfr.setEquityBackend)
+    """
+    def __init__(self, num_threads=None, calculator_class=Calculator):
+        self.NumThreads = cpu_count() if num_threads == None else num_threads
+        self.CalculatorClass = calculator_class
+        self.Pool = ThreadPool(self.NumThreads)
+        self.ThreadData = threading.local()
+
+    def _getCalculator(self):
+        """
+        Gets the Calculator that belongs to the current thread, creating it the first time.
+        """
+        if not hasattr(self.ThreadData, "calculator"):
+            self.ThreadData.calculator = self.CalculatorClass()
+        return self.ThreadData.calculator
+
+    def _calcEV(self, hands, board, dead, iters):
+        # copy the EVs out, since the Calculator will reuse its buffer on the next call
+        return np.array(self._getCalculator().calc(hands, board, dead, iters).ev)
+
+    def _calcMany(self, queries):
+        return self._getCalculator().calc_many(queries)
+
+    def submit(self, hands, board, dead, iters):
+        """
+        Starts a single query in the background.
+        Returns: an AsyncResult whose get() blocks until the query is done and returns its array of EVs.
+        """
+        return self.Pool.apply_async(self._calcEV, (hands, board, dead, iters))
+
+    def calc_many(self, queries):
+        """
+        Splits a list of queries across the threads and waits for all of them.
+        Returns: a float array of shape (len(queries), max players in a query), like Calculator.calc_many()
+        """
+        if len(queries) == 0:
+            return np.empty((0, 1))
+
+        chunkSize = (len(queries) + self.NumThreads - 1) // self.NumThreads
+        chunks = [queries[i:i+chunkSize] for i in range(0, len(queries), chunkSize)]
+        results = self.Pool.map(self._calcMany, chunks)
+
+        width = max([r.shape[1] for r in results])
+        evs = np.empty((len(queries), width))
+        evs.fill(np.nan)
+        row = 0
+        for r in results:
+            evs[row:row+len(r), 0:r.shape[1]] = r
+            row += len(r)
+        return evs
+
+    def close(self):
+        """
+        Stops the worker threads once their queued queries are done.
+        """
+        self.Pool.close()
+        self.Pool.join()
@@ -20,13 +20,17 @@
 
 """
 Python wrapper around the pbots_calc library. Requires the poker-eval library to
-be installed. Provides a single function, calc, which corresponds to the calc
-function provided by pbots_calc. Returns a Results object.
+be installed. Provides a function, calc, which corresponds to the calc
+function provided by pbots_calc and returns a Results object.
+
+Also provides a Calculator class, which reuses a pool of result buffers across
+calls and exposes EVs as numpy views instead of copying them into lists.
 """
 
 import ctypes
 import ctypes.util
 import sys
+import numpy as np
 
 if sys.platform.startswith('win'):
     pbots_calc = "pbots_calc"
@@ -42,19 +46,29 @@ class _Results(ctypes.Structure):
                 ("size", ctypes.c_int),
                 ("MC", ctypes.c_int)]
 
+# if the library is missing, AVAILABLE is False and callers should use another equity backend (see numpy_calc.py)
 try:
     pcalc = ctypes.CDLL(pbots_calc)
+    AVAILABLE = True
 except OSError:
-    print "ERROR: Could not locate %s. Please ensure your enviroment library load path is set properly." % pbots_calc
-    sys.exit(1)
+    print "WARNING: Could not locate %s. Please ensure your enviroment library load path is set properly." % pbots_calc
+    pcalc = None
+    AVAILABLE = False
 
 # Set the argtype and return types from the library.
-pcalc.calc.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int, ctypes.POINTER(_Results)]
-pcalc.calc.restype = ctypes.c_int
-pcalc.alloc_results.argtypes = []
-pcalc.alloc_results.restype = ctypes.POINTER(_Results)
-pcalc.free_results.argtypes = [ctypes.POINTER(_Results)]
-pcalc.free_results.restype = None
+if AVAILABLE:
+    pcalc.calc.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int, ctypes.POINTER(_Results)]
+    pcalc.calc.restype = ctypes.c_int
+    pcalc.alloc_results.argtypes = []
+    pcalc.alloc_results.restype = ctypes.POINTER(_Results)
+    pcalc.free_results.argtypes = [ctypes.POINTER(_Results)]
+    pcalc.free_results.restype = None
+
+# calc() mallocs the ev and hands arrays of the results it fills in, so a reused
+# buffer has to have those released (with the same allocator) before its next call.
+libc = ctypes.CDLL(ctypes.util.find_library("msvcrt" if sys.platform.startswith('win') else "c"))
+libc.free.argtypes = [ctypes.c_void_p]
+libc.free.restype = None
 
 class Results:
     def __init__(self, res):
@@ -71,6 +85,7 @@ class Results:
         return str(zip(self.hands, self.ev))
 
 def calc(hands, board, dead, iters):
+    assert AVAILABLE, "Error: %s is not loaded" % pbots_calc
     res = pcalc.alloc_results()
     err = pcalc.calc(hands, board, dead, iters, res)
     if err > 0:
@@ -80,3 +95,101 @@ def calc(hands, board, dead, iters):
         results = None
     pcalc.free_results(res)
     return results
+
+
+class CalcResult:
+    """
+    The result of a Calculator call. ev is a numpy view straight onto the C result buffer,
+    so it is only valid until the Calculator reuses that buffer (pool_size calls later).
+    """
+    def __init__(self, res):
+        self.size = res.size
+        self.MC_used = res.MC
+        self.iters = res.iters
+        self.ev = np.ctypeslib.as_array(res.ev, shape=(res.size,))
+        self._res = res
+
+    @property
+    def hands(self):
+        return [self._res.hands[i] for i in range(self.size)]
+
+    def __str__(self):
+        return str(zip(self.hands, self.ev))
+
+
+class Calculator:
+    """
+    Wraps pbots_calc calls with a pool of preallocated _Results buffers that get reused,
+    instead of allocating and freeing a buffer (and building Python lists) on every query.
+    A Calculator is not thread-safe: use one per thread.
+    """
+    def __init__(self, pool_size=1):
+        assert AVAILABLE, "Error: %s is not loaded" % pbots_calc
+        self.PoolSize = pool_size
+        self.Pool = [pcalc.alloc_results() for i in range(pool_size)]
+        self.NextBuffer = 0
+
+    def _releaseArrays(self, res):
+        """
+        Frees the ev and hands arrays that pbots_calc allocated for the last call that used this buffer.
+        """
+        r = res[0]
+        if r.hands:
+            rawHands = ctypes.cast(r.hands, ctypes.POINTER(ctypes.c_void_p))
+            for i in range(r.size):
+                libc.free(rawHands[i])
+            libc.free(rawHands)
+        if r.ev:
+            libc.free(r.ev)
+        r.hands = None
+        r.ev = None
+        r.size = 0
+
+    def _acquireBuffer(self):
+        """
+        Gets the next buffer in the pool (round robin), ready to be filled in by pbots_calc.
+        """
+        res = self.Pool[self.NextBuffer]
+        self.NextBuffer = (self.NextBuffer + 1) % self.PoolSize
+        self._releaseArrays(res)
+        return res
+
+    def calc(self, hands, board, dead, iters):
+        """
+        Same arguments as calc(). Returns a CalcResult, or None if pbots_calc couldn't parse the input.
+        """
+        res = self._acquireBuffer()
+        err = pcalc.calc(hands, board, dead, iters, res)
+        if err > 0:
+            return CalcResult(res[0])
+        else:
+            print "error: could not parse input or something..."
+            return None
+
+    def calc_many(self, queries):
+        """
+        Runs a list of (hands, board, dead, iters) queries while holding the buffer pool.
+        Returns: a float array of shape (len(queries), max players in a query), where row i holds the
+        EVs of query i (padded with nan if it has fewer players than the widest query).
+        """
+        width = max([q[0].count(":") + 1 for q in queries]) if queries else 1
+        evs = np.empty((len(queries), width))
+        evs.fill(np.nan)
+        for i in range(len(queries)):
+            result = self.calc(*queries[i])
+            if result != None:
+                evs[i, 0:result.size] = result.ev
+        return evs
+
+    def close(self):
+        """
+        Frees every buffer in the pool.
+        """
+        for res in self.Pool:
+            self._releaseArrays(res) # free_results would otherwise free these a second time
+            pcalc.free_results(res)
+        self.Pool = []
+
+    def __del__(self):
+        if getattr(self, "Pool", None):
+            self.close()
@@ -256,6 +256,15 @@ def runCFR():
         CUMULATIVE_STRATEGY = {} # dictionary of dictionaries
         print "Did not find cumulative strategy file, starting from scratch."
 
+    # warm start the hand strength cache from the last run
+    if EQUITY_CACHE.load():
+        print "Loaded in equity cache with %d entries" % len(EQUITY_CACHE.Entries)
+    else:
+        print "Did not find equity cache file, starting from scratch."
+
+    # share hand strengths with any other training processes (the file also keeps them between runs)
+    EQUITY_CACHE.attachShared(SharedEquityCache())
+
     EPSILON = 0.1
     #TAU = 1000
     BETA = 10
@@ -303,6 +312,7 @@ def runCFR():
             print "REVISIT CR:", REVISIT_CR
             print "REVISIT CS:", REVISIT_CS
             print "Overall SigmaEV:", overallSigmaEV
+            EQUITY_CACHE.printStats()
             print "*** RUNTIME: %s ***" % str(time.time() - beginCFRTime)
 
         # every 100 walks, save to json file
@@ -310,10 +320,12 @@ def runCFR():
             print "### WRITING TO LOGS ###"
             writeCumulativeStrategyToFiles()
             writeCumulativeRegretsToFiles()
+            EQUITY_CACHE.save()
         if treeWalkCounter % 1000 == 0:
             print "### WRITING TO LOGS ###"
             writeCumulativeStrategyToFiles()
             writeCumulativeRegretsToFiles()
+            EQUITY_CACHE.save()
 
         # TODO: when to end continueCFR
         # TOOD: add try except for emergency file write
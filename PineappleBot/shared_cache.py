@@ -0,0 +1,119 @@
+#!/usr/bin/env
+
+"""
+An equity cache in a memory-mapped file, shared by every process that opens it.
+
+The file is an open-addressing hash table with linear probing and fixed-size slots. Each slot holds a 64 bit
+fingerprint of the key (0 = empty) and up to 3 float values, so a cached value can be a hand strength or a
+short list like the (estimate, iters, bound) from getHandStrengthAdaptive.
+
+Lookups don't lock at all: a writer fills in a slot's values before its fingerprint, so a reader either sees no
+fingerprint yet or a finished slot. Slots are written once and never change after that (the first value cached for a
+key wins), so a reader can't see a slot's values or size change under it either. Inserts hold an exclusive flock on the file, which only serializes writers.
+Since the table lives in a file, it is also a warm start for the next run.
+"""
+
+import os
+import fcntl
+import hashlib
+import struct
+import numpy as np
+
+SLOT_DTYPE = np.dtype([('key', '<u8'), ('size', '<u4'), ('pad', '<u4'), ('values', '<f8', 3)])
+MAX_VALUES = 3
+MAX_PROBES = 64
+
+
+def getKeyFingerprint(key):
+    """
+    Hashes a cache key string to a nonzero 64 bit int (the same in every process, unlike hash()).
+    """
+    return struct.unpack('<Q', hashlib.md5(key).digest()[0:8])[0] | 1
+
+
+class SharedEquityCache(object):
+    """
+    A fixed capacity hash table of cached values in a memory-mapped file.
+    """
+    def __init__(self, filename="equityCache.bin", num_slots=2**22):
+        """
+        filename: the table file, created (sparse) if it doesn't exist yet
+        num_slots: the table size for a new file, a power of 2 (2**22 slots is 160MB). An existing file keeps its size.
+        """
+        if not os.path.isfile(filename):
+            assert (num_slots & (num_slots - 1)) == 0, "Error: num_slots must be a power of 2"
+            with open(filename, 'wb') as f:
+                f.truncate(num_slots * SLOT_DTYPE.itemsize)
+
+        self.Filename = filename
+        self.NumSlots = os.path.getsize(filename) // SLOT_DTYPE.itemsize
+        assert (self.NumSlots & (self.NumSlots - 1)) == 0, "Error: %s is not a shared equity cache file" % filename
+        self.Slots = np.memmap(filename, dtype=SLOT_DTYPE, mode='r+', shape=(self.NumSlots,))
+        self.Keys = self.Slots['key']
+        self.LockFile = open(filename, 'r+b')
+        self.Hits = 0
+        self.Misses = 0
+
+    def _probe(self, fingerprint):
+        """
+        Returns the first slot in fingerprint's probe sequence that either holds it or is empty, or None if neither
+        is found within MAX_PROBES slots.
+        """
+        start = fingerprint & (self.NumSlots - 1)
+        for i in range(MAX_PROBES):
+            slot = (start + i) & (self.NumSlots - 1)
+            slotKey = self.Keys[slot]
+            if slotKey == fingerprint or slotKey == 0:
+                return slot
+        return None
+
+    def get(self, key):
+        """
+        Returns the cached value for key (a float, or a list for multi-value entries), or None if it isn't cached.
+        """
+        fingerprint = getKeyFingerprint(key)
+        slot = self._probe(fingerprint)
+        if slot == None or self.Keys[slot] != fingerprint:
+            self.Misses += 1
+            return None
+
+        self.Hits += 1
+        size = int(self.Slots['size'][slot])
+        values = [float(v) for v in self.Slots['values'][slot][0:size]]
+        return values[0] if size == 1 else values
+
+    def put(self, key, value):
+        """
+        Inserts the value for key, unless key is already cached (then its first value is kept, since rewriting the slot
+        would race with lock-free readers). The entry is dropped if its probe sequence is full.
+        """
+        values = list(value) if isinstance(value, (list, tuple)) else [value]
+        assert len(values) <= MAX_VALUES, "Error: can only cache up to %d values per key" % MAX_VALUES
+        fingerprint = getKeyFingerprint(key)
+
+        fcntl.flock(self.LockFile, fcntl.LOCK_EX)
+        try:
+            slot = self._probe(fingerprint)
+            if slot != None and self.Keys[slot] == 0:
+                # values first, fingerprint last, so that lock-free readers never see a half written slot
+                self.Slots['values'][slot][0:len(values)] = values
+                self.Slots['size'][slot] = len(values)
+                self.Keys[slot] = fingerprint
+        finally:
+            fcntl.flock(self.LockFile, fcntl.LOCK_UN)
+
+    def __len__(self):
+        return int(np.count_nonzero(self.Keys))
+
+    def flush(self):
+        """
+        Writes the table back to its file (the OS does this eventually anyway).
+        """
+        self.Slots.flush()
+
+    def getHitRate(self):
+        lookups = self.Hits + self.Misses
+        return (float(self.Hits) / lookups) if lookups > 0 else 0.0
+
+    def printStats(self):
+        print "SHARED EQUITY CACHE: entries:%d/%d hits:%d misses:%d hit rate:%.3f" % (len(self), self.NumSlots, self.Hits, self.Misses, self.getHitRate())
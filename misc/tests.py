@@ -322,6 +322,270 @@ def testDetermineWinner():
 	print "%f percent of hands resulted in ties" % (float(tie_ctr) / iters)
 
 
+def testHandStrengthBatch():
+	"""
+	Compares the numpy batch hand strength against CALCULATOR (pbots_calc, or its numpy fallback), and times both.
+	"""
+	d = Dealer()
+	flop = d.dealFlop()
+	hands = [d.dealHand() for i in range(20)]
+
+	time0 = time.time()
+	batch = getHandStrengthBatch(hands, flop, 1000)
+	time1 = time.time()
+	single = [CALCULATOR.calc(convertSyntax(h)+":xx", convertSyntax(flop), "", 1000).ev[0] for h in hands]
+	time2 = time.time()
+
+	print "Batch time:", time1-time0, "CALCULATOR time:", time2-time1
+	print "Max difference:", max([abs(batch[i]-single[i]) for i in range(len(hands))])
+
+
+def testDetermineWinnerBatch(iters=2000):
+	"""
+	Checks determineWinnerBatch and rankHandsBatch against determineWinner on random river showdowns, and times both.
+	"""
+	deals = []
+	for i in range(iters):
+		d = Dealer()
+		deals.append((d.dealHand(), d.dealHand(), d.dealFlop() + [d.dealCard(), d.dealCard()]))
+
+	time0 = time.time()
+	single = [determineWinner(p1_hand, p2_hand, board) for p1_hand, p2_hand, board in deals]
+	time1 = time.time()
+	batch = determineWinnerBatch([p1 for p1, p2, b in deals], [p2 for p1, p2, b in deals], [b for p1, p2, b in deals])
+	time2 = time.time()
+	assert list(batch) == single, "Error: determineWinnerBatch disagrees with determineWinner"
+
+	ranks = rankHandsBatch([cardsToIndices(p1_hand + board) for p1_hand, p2_hand, board in deals])
+	assert list(ranks) == [evaluateOne(cardsToIndices(p1_hand + board)) for p1_hand, p2_hand, board in deals], "Error: rankHandsBatch disagrees with evaluateOne"
+	print "Checked", iters, "showdowns (%d ties). determineWinner time:" % single.count(3), time1-time0, "batch time:", time2-time1
+
+
+def testCanonicalize():
+	"""
+	Checks that every suit relabeling of a random (hand, board) maps to the same canonical form,
+	and that uncanonicalize() recovers the original cards.
+	"""
+	iters = 10000
+	time0 = time.time()
+	for i in range(iters):
+		d = Dealer()
+		hand = cardsToIndices(d.dealHand())
+		board = cardsToIndices([d.dealCard() for n in range(choice([0,3,4,5]))])
+
+		canonicalHand, canonicalBoard, perm = canonicalize(hand, board)
+		assert sorted(uncanonicalize(canonicalHand, perm)) == sorted(hand), "Error: uncanonicalize did not recover the hand"
+
+		for p in SUIT_PERMUTATIONS:
+			assert canonicalize(applySuitPermutation(hand, p), applySuitPermutation(board, p))[0:2] == (canonicalHand, canonicalBoard)
+	time1 = time.time()
+	print "Checked", iters, "hands in", time1-time0, "secs"
+
+
+def testSamplingMethods(num_hands=5, trials=30):
+	"""
+	Compares the error of each sampling.py method against exact flop and turn hand strengths, at several iteration counts.
+	"""
+	from sampling import sampleHandStrength, SAMPLING_METHODS
+
+	# random flop and turn spots, with their exact hand strengths
+	spots = []
+	for i in range(num_hands):
+		d = Dealer()
+		hand = cardsToIndices(d.dealHand())
+		flop = cardsToIndices(d.dealFlop())
+		turn = flop + [cardToIndex(d.dealCard())]
+		spots.append((hand, flop, mean([BoardContext(flop + list(r)).getEquity(hand) for r in combinations([c for c in range(52) if c not in hand+flop], 2)])))
+		spots.append((hand, turn, TurnContext(turn).getEquity(hand)))
+
+	print "ITERS  METHOD      RMSE     TIME(ms)"
+	for iters in [100, 250, 500, 1000]:
+		for method in SAMPLING_METHODS:
+			time0 = time.time()
+			errors = [sampleHandStrength(hand, board, iters, method) - exact for hand, board, exact in spots for t in range(trials)]
+			time1 = time.time()
+			print "%-6d %-11s %.5f  %.2f" % (iters, method, np.sqrt(np.mean(np.square(errors))), 1000*(time1-time0)/len(errors))
+
+
+def testEquityBackends(num_spots=10, iters=1000):
+	"""
+	Benchmarks every available equity backend (see cfr.EQUITY_BACKENDS) on "hand:xx" queries,
+	for speed and for error against exact flop, turn and river hand strengths.
+	"""
+	# random spots on each street, with their exact hand strengths
+	spots = []
+	for i in range(num_spots):
+		d = Dealer()
+		hand = cardsToIndices(d.dealHand())
+		board = cardsToIndices(d.dealFlop() + [d.dealCard(), d.dealCard()])
+		spots.append((hand, board[0:3], getHandStrengthMoments(board[0:3], [hand])[0][0]))
+		spots.append((hand, board[0:4], TurnContext(board[0:4]).getEquity(hand)))
+		spots.append((hand, board, BoardContext(board).getEquity(hand)))
+
+	print "BACKEND      STREET  RMSE     TIME(ms)"
+	for name, backend in EQUITY_BACKENDS.items():
+		if not backend.AVAILABLE:
+			print "%-12s not available" % name
+			continue
+		calculator = backend.Calculator()
+		for street, boardSize in [("flop", 3), ("turn", 4), ("river", 5)]:
+			errors = []
+			time0 = time.time()
+			for hand, board, exact in spots:
+				if len(board) == boardSize:
+					errors.append(calculator.calc(indicesToString(hand)+":xx", indicesToString(board), "", iters).ev[0] - exact)
+			time1 = time.time()
+			print "%-12s %-7s %.5f  %.2f" % (name, street, np.sqrt(np.mean(np.square(errors))), 1000*(time1-time0)/len(errors))
+
+
+def testEquityMatrix(num_boards=4, num_pairs=200):
+	"""
+	Checks getEquityMatrix on random turn and river boards (relabeled from their canonical board): entries against
+	showdowns of random holding pairs ranked with evaluateOne, and each row's mean against the exact hand strength.
+	"""
+	from equity_matrix import getEquityMatrix
+
+	for i in range(num_boards):
+		d = Dealer()
+		board = cardsToIndices(d.dealFlop() + [d.dealCard(), d.dealCard()])[0:4 + i % 2]
+		time0 = time.time()
+		matrix = getEquityMatrix(board)
+		time1 = time.time()
+
+		deck = [c for c in range(52) if c not in board]
+		for n in range(num_pairs):
+			cards = list(choice(deck, 4, replace=False))
+			h1, h2 = sorted(cards[0:2]), sorted(cards[2:4])
+			rivers = [[]] if len(board) == 5 else [[r] for r in deck if r not in cards]
+			showdowns = []
+			for river in rivers:
+				r1, r2 = evaluateOne(h1 + board + river), evaluateOne(h2 + board + river)
+				showdowns.append(1.0 if r1 > r2 else (0.5 if r1 == r2 else 0.0))
+			assert abs(matrix[HOLDING_INDEX[h1[0], h1[1]], HOLDING_INDEX[h2[0], h2[1]]] - mean(showdowns)) < 1e-5, "Error: wrong matrix entry"
+
+		hand = sorted(list(choice(deck, 2, replace=False)))
+		exact = getRiverHandStrength(hand, board) if len(board) == 5 else TurnContext(board).getEquity(hand)
+		assert abs(np.nanmean(matrix[HOLDING_INDEX[hand[0], hand[1]]]) - exact) < 1e-5, "Error: a row's mean is not the hand strength"
+		print "Checked the %d card board %s, took %.2f secs to build" % (len(board), indicesToString(board), time1-time0)
+
+
+def testRangeEquity(num_spots=10):
+	"""
+	Checks getRangeEquity: a uniform range has to match the exact "xx" hand strength on the turn and river (and be
+	close on the flop), and a narrower range is printed next to it for comparison.
+	"""
+	uniform = np.ones(len(HOLDINGS))
+	pairs = (HOLDINGS[:, 0] // 4 == HOLDINGS[:, 1] // 4).astype(np.float64)
+	for i in range(num_spots):
+		d = Dealer()
+		hand = cardsToIndices(d.dealHand())
+		board = cardsToIndices(d.dealFlop() + [d.dealCard(), d.dealCard()])
+		getTurnContext(board[0:4])
+
+		assert abs(getRangeEquity(hand, board, uniform) - getRiverHandStrength(hand, board)) < 1e-9
+		assert abs(getRangeEquity(hand, board[0:4], uniform) - getTurnHandStrength(hand, board[0:4])) < 1e-9
+		flop = getRangeEquity(hand, board[0:3], uniform, 4000)
+		exact = getHandStrengthMoments(board[0:3], [hand])[0][0]
+		assert abs(flop - exact) < 0.05, "Error: the sampled flop range equity is too far from the exact hand strength"
+		print indicesToString(hand), indicesToString(board[0:3]), "uniform: %.3f (exact %.3f) pairs only: %.3f" % \
+			(flop, exact, getRangeEquity(hand, board[0:3], pairs, 4000))
+
+
+def testDiscardEstimators(num_spots=100):
+	"""
+	Compares the discard decisions of determineBestDiscardFast, determineBestDiscardCRN (at several iteration counts)
+	and determineBestDiscardFull against the exact decision (determineBestDiscardFull with every flop runout), on
+	random flops and turns.
+	"""
+	estimators = [("fast", lambda h, b: determineBestDiscardFast(h, b))]
+	for iters in [50, 100, 200, 400]:
+		estimators.append(("crn%d" % iters, lambda h, b, iters=iters: determineBestDiscardCRN(h, b, iters=iters)))
+	estimators.append(("full", lambda h, b: determineBestDiscardFull(h, b)))
+
+	agrees = dict([(name, 0) for name, estimator in estimators])
+	times = dict([(name, 0.0) for name, estimator in estimators])
+	for i in range(num_spots):
+		d = Dealer()
+		hand = d.dealHand()
+		board = d.dealFlop() + ([d.dealCard()] if i % 2 == 1 else [])
+		exact = determineBestDiscardFull(hand, board, runouts=None)[0:2]
+		for name, estimator in estimators:
+			time0 = time.time()
+			decision = estimator(hand, board)
+			times[name] += time.time() - time0
+			agrees[name] += int(decision[0:2] == exact)
+
+	for name, estimator in estimators:
+		print "%-8s agrees with exact: %.2f  time: %.1fms" % (name, float(agrees[name]) / num_spots, 1000*times[name] / num_spots)
+
+
+def testDiscardAwareEquity(num_spots=4):
+	"""
+	Checks the live discard-aware equity of single hands (what getDiscardAwareEquity computes when a board isn't in
+	the table): on turns against a brute force over every discard, replacement and river card, and on one flop
+	against the whole board row of computeDiscardAwareEquities.
+	"""
+	from discard_table import computeHandDiscardAwareEquity, computeDiscardAwareEquities
+
+	for i in range(num_spots):
+		d = Dealer()
+		hand = cardsToIndices(d.dealHand())
+		board = cardsToIndices(d.dealFlop() + [d.dealCard()])
+		contexts = dict([(r, BoardContext(board + [r])) for r in range(52) if r not in board])
+
+		keepEV = mean([contexts[r].getEquity(hand) for r in contexts if r not in hand])
+		swapEVs = []
+		for discard in range(2):
+			kept = hand[1 - discard]
+			equities = []
+			for replacement in [c for c in contexts if c not in hand]:
+				equities.append(mean([contexts[r].getEquity([replacement, kept], hand[discard]) for r in contexts if r not in hand + [replacement]]))
+			swapEVs.append(mean(equities))
+		exact = max([keepEV] + swapEVs)
+
+		time0 = time.time()
+		live = computeHandDiscardAwareEquity(hand, board)
+		time1 = time.time()
+		assert abs(live - exact) < 1e-9, "Error: wrong discard-aware equity on the turn"
+		print indicesToString(hand), indicesToString(board), "%.4f, took %.2f secs" % (live, time1-time0)
+
+	d = Dealer()
+	hand = sorted(cardsToIndices(d.dealHand()))
+	flop = cardsToIndices(d.dealFlop())
+	time0 = time.time()
+	live = computeHandDiscardAwareEquity(hand, flop)
+	time1 = time.time()
+	assert abs(live - computeDiscardAwareEquities(flop)[HOLDING_INDEX[hand[0], hand[1]]]) < 1e-9, "Error: wrong discard-aware equity on the flop"
+	print indicesToString(hand), indicesToString(flop), "%.4f, took %.2f secs" % (live, time1-time0)
+
+
+def testSharedEquityCache(num_keys=200):
+	"""
+	Checks SharedEquityCache in a small temporary file: single and multi-value entries come back as they were put,
+	putting a key again keeps its first value, and a second handle on the same file sees every entry.
+	"""
+	import os, tempfile
+	filename = os.path.join(tempfile.mkdtemp(), "testCache.bin")
+	cache = SharedEquityCache(filename, num_slots=1024)
+
+	values = {}
+	for i in range(num_keys):
+		key = "key%d" % i
+		values[key] = float(i) / num_keys if i % 2 == 0 else [float(i), 2.0*i, 3.0*i][0:2 + i % 4 // 3]
+		cache.put(key, values[key])
+	assert cache.get("missing") == None, "Error: found a key that was never put"
+
+	for key in values:
+		cache.put(key, -1.0) # not allowed to overwrite, since readers don't lock
+	other = SharedEquityCache(filename)
+	for key in values:
+		assert cache.get(key) == values[key] and other.get(key) == values[key], "Error: wrong value for %s" % key
+	assert len(cache) == num_keys and len(other) == num_keys, "Error: wrong number of entries"
+
+	os.remove(filename)
+	print "Put and read back %d entries" % num_keys
+
+
 def testHistory():
 	"""
 	(history, node_type, current_street, current_round, button_player, dealer, \
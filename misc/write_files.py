@@ -10,6 +10,11 @@ def getHandStrengthSquaredExhaustive(hand, board, deck):
 	assert len(hand) + len(board) <= 7, "Error: hand cannot have more than 7 cards."
 	assert len(hand) + len(board) + len(deck) == 52, "Error: hand and deck should add up to 52 cards"
 
+	# on the flop and turn, enumerate every runout and opponent holding with the vectorized evaluator
+	if len(board) == 3 or len(board) == 4:
+		ehs, ehs2 = getHandStrengthMoments(cardsToIndices(board), [cardsToIndices(list(hand))])
+		return float(ehs2[0])
+
 	numCardsToSample = 5 - len(board)
 	# compute the expectation of the hand strength squared when there is a full board
 	# this is the average hand strength over all possible outcomes for the board
@@ -181,19 +186,15 @@ def writeRiverHandStrengthFile():
 			hands = list(combinations(new_deck, 2))
 			assert len(hands) == 1081, "Error: should be 1081 hands"
 
-			for h in hands:
-				h = list(h)
-
-				current_deck = new_deck[:]
-				current_deck.remove(h[0])
-				current_deck.remove(h[1])
+			# rank every holding on this board once, then each hand's strength is just a lookup
+			context = BoardContext(cardsToIndices(b))
+			strengths = context.getEquities(np.array([cardsToIndices(list(h)) for h in hands]))
 
-				hs = HandEvaluator.evaluate_hand(h,b)
+			for h, hs in zip(hands, strengths):
 				handstr = str(h[0]) + str(h[1])
 				handstr = handstr.replace('<Card(', '')
 				handstr = handstr.replace(')>', '')
 				f.write(handstr+":"+str(hs)[0:5]+"\n")
-				f.flush()
 			f.close()
 		board_end_time = time.time()
 		print "Board took", board_end_time-board_start_time, "secs"
@@ -236,19 +237,14 @@ def writeFlopHandStrengthSquaredFile():
 			hands = list(combinations(new_deck, 2))
 			assert len(hands) == 1176, "Error: should be 1176 hands"
 
-			for h in hands:
-				h = list(h)
-
-				current_deck = new_deck[:]
-				current_deck.remove(h[0])
-				current_deck.remove(h[1])
+			# exact HSS of every hand on this board at once (every runout and opponent holding is enumerated)
+			ehs, hss = getHandStrengthMoments(cardsToIndices(b), np.array([cardsToIndices(list(h)) for h in hands]))
 
-				hss_sampled = getHandStrengthSquaredSampled(h, b, current_deck)
+			for h, hss_exact in zip(hands, hss):
 				handstr = str(h[0]) + str(h[1])
 				handstr = handstr.replace('<Card(', '')
 				handstr = handstr.replace(')>', '')
-				f.write(handstr+":"+str(hss_sampled)[0:5]+"\n")
-				f.flush()
+				f.write(handstr+":"+str(hss_exact)[0:5]+"\n")
 			f.close()
 		board_end_time = time.time()
 		print "Board took", board_end_time-board_start_time, "secs"
@@ -284,3 +280,104 @@ def writePreflopHandStrengthFile():
 	print "Took", time1-time0, "secs"
 	f.close()
 
+
+
+def getAllHoldingEquities(boards):
+	"""
+	Computes the exact river equity of every holding on each of a batch of 5 card boards, against a random opponent holding.
+	boards: an int array of shape (M, 5)
+	Returns: (holdings, equities) with shapes (M, 1081, 2) and (M, 1081)
+
+	Instead of comparing all 1081x1081 pairs of holdings, we count the holdings that rank below each holding on the board,
+	then subtract the ones that share a card with it (inclusion-exclusion over its 2 cards).
+	Same idea as BoardContext.getEquities(), but for a whole batch of boards at once.
+	"""
+	M = len(boards)
+	pairs = HOLDING_PAIRS # positions in the remaining deck of each holding
+	contains = HOLDINGS_WITH_POSITION # holdings that use each position
+
+	inDeck = np.ones((M, 52), dtype=bool)
+	inDeck[np.arange(M)[:, None], boards] = False
+	remaining = np.nonzero(inDeck)[1].reshape(M, 47)
+	holdings = remaining[:, pairs]
+
+	cards = np.concatenate([holdings, np.repeat(boards[:, None, :], len(pairs), axis=1)], axis=2)
+	ranks = evaluate(cards.reshape(-1, 7)).reshape(M, len(pairs)).astype(np.int64)
+
+	# count holdings below / equal to each holding, across the whole board
+	rowOffsets = np.arange(M)[:, None] * 8192
+	sortedRanks = (np.sort(ranks, axis=1) + rowOffsets).ravel()
+	queries = ranks + rowOffsets
+	lessAll = np.searchsorted(sortedRanks, queries, 'left') - np.arange(M)[:, None]*len(pairs)
+	equalAll = np.searchsorted(sortedRanks, queries, 'right') - np.arange(M)[:, None]*len(pairs) - lessAll
+
+	# count holdings below / equal to each holding, among the holdings that use each card
+	cardOffsets = (np.arange(M)[:, None] * 47 + np.arange(47)[None, :]) * 8192
+	sortedCardRanks = (np.sort(ranks[:, contains], axis=2) + cardOffsets[:, :, None]).ravel()
+	base = (np.arange(M)[:, None] * 47 + np.arange(47)[None, :]) * contains.shape[1]
+	wins, ties = lessAll, equalAll + 1 # + 1 since the holding itself uses both of its cards
+	for k in range(2):
+		cardQueries = ranks + cardOffsets[:, pairs[:, k]]
+		lessCard = np.searchsorted(sortedCardRanks, cardQueries, 'left') - base[:, pairs[:, k]]
+		wins = wins - lessCard
+		ties = ties - (np.searchsorted(sortedCardRanks, cardQueries, 'right') - base[:, pairs[:, k]] - lessCard)
+
+	return holdings, (wins + 0.5*ties) / 990.0
+
+
+def writePreflopEquityTable(filename='preflop_equity.txt', batch_size=200):
+	"""
+	Writes the exact equity of each of the 169 preflop hand classes against a random opponent hand.
+	Every 5 card board is enumerated (up to suit isomorphism, weighted by how many boards it stands for),
+	so the values are exact rather than sampled. cfr.py loads this table at import.
+	"""
+	time0 = time.time()
+
+	# count how many boards map to each canonical board
+	boardWeights = {}
+	for b in combinations(range(52), 5):
+		key = tuple(canonicalize([], list(b))[1])
+		boardWeights[key] = boardWeights.get(key, 0) + 1
+	canonicalBoards = np.array(boardWeights.keys())
+	weights = np.array(boardWeights.values(), dtype=np.float64)
+	print "Enumerating", len(canonicalBoards), "canonical boards, took", time.time()-time0, "secs"
+
+	classIndex = np.zeros((52, 52), dtype=np.int64)
+	for c1 in range(52):
+		for c2 in range(52):
+			classIndex[c1][c2] = getPreflopClassIndex([c1, c2])
+
+	equitySums = np.zeros(169)
+	weightSums = np.zeros(169)
+	for start in range(0, len(canonicalBoards), batch_size):
+		holdings, equities = getAllHoldingEquities(canonicalBoards[start:start+batch_size])
+		classes = classIndex[holdings[:, :, 0], holdings[:, :, 1]].ravel()
+		boardWeight = np.repeat(weights[start:start+batch_size], holdings.shape[1])
+		equitySums += np.bincount(classes, weights=equities.ravel()*boardWeight, minlength=169)
+		weightSums += np.bincount(classes, weights=boardWeight, minlength=169)
+		if (start / batch_size) % 100 == 0:
+			print "Working on board", start
+
+	with open(filename, 'w') as f:
+		f.write("# exact preflop equity of each hand class against a random opponent hand\n")
+		f.write("# index = 13*r1+r2 (ranks 0-12): pairs r1==r2, suited r1>r2, offsuit r1<r2\n")
+		f.write("VERSION %d\n" % PREFLOP_EQUITY_VERSION)
+		for i in range(169):
+			f.write("%s %.6f\n" % (getPreflopClassName(i), equitySums[i] / weightSums[i]))
+
+	time1 = time.time()
+	print "Took", time1-time0, "secs"
+
+
+def writeDiscardTables(processes=None):
+	"""
+	Builds the discard-aware equity and discard policy tables for every canonical flop and turn board (see
+	discard_table.py), on a process pool. This takes several CPU hours for each table, but it can be stopped at any
+	time: running it again only computes the boards that aren't done yet. cfr.py memory-maps the tables at import.
+	"""
+	time0 = time.time()
+	buildDiscardTable(3, processes=processes)
+	buildDiscardTable(4, processes=processes)
+	buildDiscardPolicyTable(3, processes=processes)
+	buildDiscardPolicyTable(4, processes=processes)
+	print "Took", time.time()-time0, "secs"